@@ -0,0 +1,149 @@
+""" Usage audit log for the Lambda handler.
+
+Events are queued by record(), which never blocks, and written to a sink in batches on a
+background thread. Any problem writing a batch is logged and the batch dropped, so the audit
+log can never fail or slow down a request.
+
+On Lambda the sandbox is frozen as soon as the handler returns, so a background thread would
+only get to write during some later invocation, or never if the sandbox is recycled. There
+the log has no thread and the handler flushes it at the end of each invocation instead, which
+adds one DynamoDB batch write (a few ms) to each response.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger('togglcon.audit')
+
+
+class MemorySink():
+    """ Keeps the events in a list, for tests. """
+
+    def __init__(self):
+        self.events = []
+
+
+    def write(self, events):
+        self.events.extend(events)
+
+
+class FileSink():
+    """ Appends the events to a file as json lines. """
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def write(self, events):
+        with open(self.path, 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+
+
+class DynamoDBSink():
+    """ Writes the events to the TogglCon.log DynamoDB table. """
+
+    def __init__(self, table_name='TogglCon.log'):
+        self.table_name = table_name
+        self.table = None
+
+
+    def write(self, events):
+        if self.table is None:
+            # Import the AWS SDK when it is first needed, it is slow to load
+            import boto3
+            self.table = boto3.resource('dynamodb').Table(self.table_name)
+        # Events for one email in the same second share a key, which BatchWriteItem rejects
+        # unless the writer drops all but the last of them, as put_item would have overwritten them
+        with self.table.batch_writer(overwrite_by_pkeys=['ID-timestamp']) as batch:
+            for event in events:
+                batch.put_item(Item=dict(event, **{'ID-timestamp': event['time'] + '_' + event['email']}))
+
+
+class AuditLog():
+    """ Queues events and writes them to a sink in batches on a background thread. """
+
+    def __init__(self, sink, batch_size=25, flush_interval=1.0, max_queued=10000, background=True):
+        self.sink = sink
+        self.background = background    # False to only write when flush() is called
+        self.batch_size = batch_size    # DynamoDB writes at most 25 items a batch
+        self.flush_interval = flush_interval    # seconds a queued event waits at most
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+
+    def record(self, email, **fields):
+        """Queue an event, stamped with the current GMT time."""
+        now = time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime())
+        try:
+            self.queue.put_nowait(dict(fields, time=now, email=email))
+        except queue.Full:
+            logger.warning('Audit log queue is full, dropping event')
+            return
+        if self.background:
+            self.start()
+
+
+    def start(self):
+        """Start the background writer, if it isn't running."""
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='audit-log', daemon=True)
+                self.thread.start()
+
+
+    def run(self):
+        """Write batches as they fill up, or every flush_interval seconds."""
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+
+    def write(self, batch):
+        """Write a batch to the sink, dropping it if that fails."""
+        with self.write_lock:
+            try:
+                self.sink.write(batch)
+            except Exception:
+                logger.exception(f'Unable to write {len(batch)} audit events')
+
+
+    def flush(self):
+        """Write everything queued now, e.g. at the end of an invocation or on exit."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) == self.batch_size:
+                self.write(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+
+
+def from_environment():
+    """The audit log to use here: DynamoDB on AWS, the file in TOGGLCON_AUDIT_FILE if set, otherwise None."""
+    if 'AWS_EXECUTION_ENV' in os.environ:
+        return AuditLog(DynamoDBSink(), background=False)   # flushed by the handler, see above
+    elif os.environ.get('TOGGLCON_AUDIT_FILE'):
+        sink = FileSink(os.environ['TOGGLCON_AUDIT_FILE'])
+    else:
+        return None
+    log = AuditLog(sink)
+    atexit.register(log.flush)
+    return log
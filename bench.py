@@ -0,0 +1,264 @@
+""" Offline benchmarks for togglcon.
+
+Generates realistic Toggl /details payloads from a seed, serves them from a local stand-in
+for the Toggl api (with pagination and 429s) and times the app against it:
+
+    python bench.py                      # every scale
+    python bench.py --scale large --seed 3 > bench_output.txt
+
+For each scale the latency (median of the repeats), throughput (entries per second) and peak
+Python memory (tracemalloc) of get_detailed_data, summary_data, create_df, summary_range
+(fetch whole), summary_stream and lambda_handler are reported.
+"""
+
+import argparse
+import collections
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import date as date_type, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import logic
+import togglapi
+
+# name: (entries per day, days, projects, description duplication)
+SCALES = {
+    'small': (10, 1, 5, 0.5),
+    'medium': (40, 7, 20, 0.6),
+    'large': (100, 31, 60, 0.8),
+}
+CHARGE_TAGS = ['LABOUR-ENG', 'LEAVE', 'NR-ADMIN', 'NR-ENGQUOT']
+OTHER_TAGS = ['billable', 'remote', 'overtime']
+CLIENTS = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark']
+WORDS = ['design', 'review', 'calcs', 'meeting', 'site', 'visit', 'drawings', 'email', 'report', 'pump', 'valve', 'quote']
+
+
+class PayloadGenerator():
+    """ Seeded generator of Toggl Reports v2 /details entries.
+
+    Projects use both project code formats (P-xaa-xxx/Jaa-xxx and Pxxxxxxx/Wxxxxxxx) plus NR.
+    duplication is the share of entries reusing an earlier description on the same day.
+    """
+
+    def __init__(self, seed=1, entries_per_day=40, projects=20, duplication=0.6, other_tag_rate=0.2):
+        self.seed = seed
+        self.entries_per_day = entries_per_day
+        self.duplication = duplication
+        self.other_tag_rate = other_tag_rate
+        rng = random.Random(seed)
+        self.projects = ['NR'] + [self.project_name(rng, i) for i in range(projects - 1)]
+        self.clients = {project: rng.choice(CLIENTS) for project in self.projects}
+
+
+    def project_name(self, rng, i):
+        """A project name in one of the two code formats."""
+        title = rng.choice(WORDS).title() + '/' + rng.choice(WORDS).title()
+        if i % 2:
+            return f'P-{rng.randint(1, 9)}{rng.choice("ABCDEF")}{rng.choice("GHIJ")}{rng.choice("KLMN")}-{rng.randint(100, 999)}-{rng.randint(10000, 99999)}/J{rng.choice("ABC")}{rng.choice("DEF")}-{rng.randint(100, 999)}-{rng.randint(10000, 99999)} - {title}'
+        return f'P{rng.randint(1000000, 9999999)}/W{rng.randint(1000000, 99999999)} - {title}'
+
+
+    def day(self, day):
+        """Entries for one day (a date), the same every time for the same seed and day."""
+        rng = random.Random(f'{self.seed}-{day.isoformat()}')
+        entries = []
+        descriptions = []
+        start = 7 * 60 * 60
+        for i in range(self.entries_per_day):
+            if descriptions and rng.random() < self.duplication:
+                description = rng.choice(descriptions)
+            else:
+                description = ' '.join(rng.sample(WORDS, 3))
+                descriptions.append(description)
+            project = rng.choice(self.projects)
+            tags = [rng.choice(CHARGE_TAGS)]
+            if rng.random() < self.other_tag_rate:
+                tags.append(rng.choice(OTHER_TAGS))
+            dur = rng.randint(1, 90) * 60 * 1000
+            begin = f'{day.isoformat()}T{start // 3600 % 24:02d}:{start // 60 % 60:02d}:00+10:00'
+            start += dur // 1000
+            entries.append({
+                'id': rng.randint(10 ** 9, 10 ** 10), 'pid': zlib.crc32(project.encode()), 'tid': None, 'uid': 1234567,
+                'description': description, 'start': begin,
+                'end': f'{day.isoformat()}T{start // 3600 % 24:02d}:{start // 60 % 60:02d}:00+10:00',
+                'updated': f'{day.isoformat()}T18:00:00+10:00', 'dur': dur, 'user': 'Test User', 'use_stop': True,
+                'client': self.clients[project], 'project': project, 'project_color': '0', 'project_hex_color': '#06aaf5',
+                'task': None, 'billable': None, 'is_billable': False, 'cur': None, 'tags': tags,
+            })
+        return entries
+
+
+    def report(self, since, until):
+        """Entries for every day from since to until (dates)."""
+        entries = []
+        day = since
+        while day <= until:
+            entries.extend(self.day(day))
+            day += timedelta(days=1)
+        return entries
+
+
+class StandInServer():
+    """ Local stand-in for the Toggl api serving a PayloadGenerator's entries.
+
+    Serves /reports/api/v2/details with paging and /api/v9/workspaces. Every
+    rate_limit_every'th request is answered with a 429 (Retry-After: 0), like Toggl does
+    when its rate limit is hit.
+    """
+
+    def __init__(self, generator, per_page=50, rate_limit_every=0):
+        self.generator = generator
+        self.per_page = per_page
+        self.rate_limit_every = rate_limit_every
+        self.requests = 0
+        self.reports = {}   # (since, until) -> entries, generated once
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive, like the real api
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                with server.lock:
+                    server.requests += 1
+                    limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+                if limited:
+                    return self.reply(429, {'error': 'Too many requests'}, {'Retry-After': '0'})
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if url.path == '/reports/api/v2/details':
+                    return self.reply(200, server.details(params))
+                if url.path == '/api/v9/workspaces':
+                    return self.reply(200, [{'id': 1234567, 'name': 'Stand-in workspace'}])
+                return self.reply(404, {'error': 'Not found'})
+
+            def reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+    def details(self, params):
+        """One page of the detailed report."""
+        since = date_type.fromisoformat(params['since'])
+        until = date_type.fromisoformat(params['until'])
+        with self.lock:
+            if (since, until) not in self.reports:
+                self.reports[(since, until)] = self.generator.report(since, until)
+            entries = self.reports[(since, until)]
+        page = int(params.get('page', 1))
+        return {'total_count': len(entries), 'per_page': self.per_page,
+                'data': entries[(page - 1) * self.per_page:page * self.per_page]}
+
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def measure(fn, repeats):
+    """Run fn repeats times, returning the median seconds and the peak traced memory (bytes).
+
+    Memory is traced on an extra run so tracing doesn't slow down the timed runs."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def run_scale(name, seed=1, repeats=5, rate_limit_every=0):
+    """Benchmark every phase at one scale, returning a list of result dicts."""
+    import togglcon
+
+    entries_per_day, days, projects, duplication = SCALES[name]
+    generator = PayloadGenerator(seed, entries_per_day, projects, duplication)
+    since = date_type(2024, 8, 1)
+    until = since + timedelta(days=days - 1)
+    dates = (since.strftime('%d/%m/%y'), until.strftime('%d/%m/%y'))
+    day_entries = {'data': generator.day(since)}
+    results = []
+
+    with StandInServer(generator, rate_limit_every=rate_limit_every) as server:
+        client = togglapi.TogglClient(server.url, rate=1000, burst=50, backoff=0.01)
+        timesheet = logic.TimeLogic('bench', 'bench@test.com', '1234567', client)
+        rows = timesheet.aggregate_entries(day_entries['data'])[0]
+        for row in rows:
+            row['time_rounded'] = 1.0
+
+        phases = [
+            ('get_detailed_data', lambda: timesheet.get_detailed_range(*dates), entries_per_day * days),
+            ('summary_data', lambda: timesheet.summary_data(dates[0], day_entries), entries_per_day),
+            ('create_df', lambda: timesheet.create_df({'date': dates[0], 'data': rows}), len(rows)),
+            ('summary_range', lambda: timesheet.summary_range(*dates), entries_per_day * days),
+            ('summary_stream', lambda: collections.deque(timesheet.summary_stream(*dates), maxlen=0), entries_per_day * days),
+        ]
+        # The handler makes its own TimeLogic with the shared client, point that at the stand-in
+        previous, togglapi._default_client = togglapi._default_client, client
+        event = {'togglapikey': 'bench', 'email': 'bench@test.com', 'workspace_ID': '1234567',
+                 'date': since.isoformat(), 'refresh': True}
+        phases.append(('lambda_handler', lambda: togglcon.lambda_handler(event, {}), entries_per_day))
+        try:
+            for phase, fn, count in phases:
+                seconds, peak = measure(fn, repeats)
+                results.append({'scale': name, 'phase': phase, 'entries': count, 'ms': seconds * 1000,
+                                'entries_per_s': count / seconds if seconds else 0, 'peak_kib': peak / 1024})
+        finally:
+            togglapi._default_client = previous
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark togglcon against a local stand-in for the Toggl api.')
+    parser.add_argument('--scale', choices=list(SCALES), action='append', help='scale to run (default all)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every n-th request with a 429')
+    parser.add_argument('--json', action='store_true', help='print results as json lines')
+    args = parser.parse_args()
+
+    if not args.json:
+        print(f"{'scale':<8}{'phase':<20}{'entries':>9}{'median ms':>12}{'entries/s':>12}{'peak KiB':>10}")
+    for name in args.scale or list(SCALES):
+        for result in run_scale(name, args.seed, args.repeats, args.rate_limit_every):
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(f"{result['scale']:<8}{result['phase']:<20}{result['entries']:>9}{result['ms']:>12.2f}"
+                      f"{result['entries_per_s']:>12.0f}{result['peak_kib']:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as date_type, timedelta
+
+
+def default_path():
+    """Keep the cache next to settings.txt, or in /tmp on AWS Lambda."""
+    if 'AWS_EXECUTION_ENV' in os.environ:
+        return '/tmp/togglcon_cache.sqlite'
+    return 'cache.sqlite'
+
+
+class DayCache():
+    """ On-disk cache of each day's Toggl report entries, keyed by (workspace_id, user, date).
+
+    Days of the current timesheet week (and yesterday, allowing for the Toggl user and this
+    machine being in different timezones) are only kept for recent_ttl seconds as they are
+    still being edited, days before it are closed and kept for closed_ttl. A day whose summary
+    failed is forgotten (see forget), as the user is about to fix it. When the cache grows
+    past max_bytes the least recently fetched days are dropped. Set bypass (or
+    TOGGLCON_NO_CACHE=1) to always refetch, the fresh results are still stored.
+    """
+
+    def __init__(self, path=None, recent_ttl=5 * 60, closed_ttl=30 * 24 * 60 * 60, max_bytes=20 * 1024 * 1024, bypass=None):
+        self.path = path or default_path()
+        self.recent_ttl = recent_ttl
+        self.closed_ttl = closed_ttl
+        self.max_bytes = max_bytes
+        self.bypass = bool(os.environ.get('TOGGLCON_NO_CACHE')) if bypass is None else bypass
+        self.lock = threading.Lock()
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS days (workspace_id TEXT, user TEXT, date TEXT, fetched REAL, '
+                       'size INTEGER, entries TEXT, PRIMARY KEY (workspace_id, user, date))')
+
+
+    @contextmanager
+    def connect(self):
+        """Open the database for one transaction."""
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+    def ttl(self, day):
+        """Seconds a day's entries stay fresh for."""
+        today = date_type.today()
+        if day >= min(today - timedelta(days=today.weekday()), today - timedelta(days=1)):
+            return self.recent_ttl
+        return self.closed_ttl
+
+
+    def get(self, workspace_id, user, day):
+        """Get the cached entries for a day (a date), or None if missing or stale."""
+        if self.bypass:
+            return None
+        with self.lock, self.connect() as db:
+            row = db.execute('SELECT fetched, entries FROM days WHERE workspace_id = ? AND user = ? AND date = ?',
+                             (str(workspace_id), user, day.isoformat())).fetchone()
+        if row is None or time.time() - row[0] > self.ttl(day):
+            return None
+        return json.loads(row[1])
+
+
+    def fresh_days(self, workspace_id, user, start, end):
+        """Get the set of days (dates) from start to end that are cached and not stale, without reading their entries."""
+        if self.bypass:
+            return set()
+        with self.lock, self.connect() as db:
+            rows = db.execute('SELECT date, fetched FROM days WHERE workspace_id = ? AND user = ? AND date BETWEEN ? AND ?',
+                              (str(workspace_id), user, start.isoformat(), end.isoformat())).fetchall()
+        now = time.time()
+        days = [(date_type.fromisoformat(date), fetched) for date, fetched in rows]
+        return {day for day, fetched in days if now - fetched <= self.ttl(day)}
+
+
+    def put(self, workspace_id, user, day, entries):
+        """Store a day's entries, evicting the oldest days if the cache is too big."""
+        data = json.dumps(entries)
+        with self.lock, self.connect() as db:
+            db.execute('INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?, ?, ?)',
+                       (str(workspace_id), user, day.isoformat(), time.time(), len(data), data))
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM days').fetchone()[0]
+            if total > self.max_bytes:
+                for rowid, size in db.execute('SELECT rowid, size FROM days ORDER BY fetched').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    db.execute('DELETE FROM days WHERE rowid = ?', (rowid,))
+                    total -= size
+
+
+    def forget(self, workspace_id, user, day):
+        """Drop a day (a date), so it is fetched again next time."""
+        with self.lock, self.connect() as db:
+            db.execute('DELETE FROM days WHERE workspace_id = ? AND user = ? AND date = ?',
+                       (str(workspace_id), user, day.isoformat()))
+
+
+    def clear(self, workspace_id, user):
+        """Drop every cached day of a user."""
+        with self.lock, self.connect() as db:
+            db.execute('DELETE FROM days WHERE workspace_id = ? AND user = ?', (str(workspace_id), user))
@@ -3,30 +3,64 @@ import json
 import logging
 import os.path
 from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
-import requests
+import metadata
+import timing
+import togglapi
 import textwrap
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Alignment, NamedStyle
+
+# Column order of the Excel timesheet
+COLUMNS = ['Date', 'Branch', 'Charge Type', 'Project No', 'Job No', 'Description', 'Hours']
+
+# The only settings read from settings.txt, and the keys of each member in team.json
+SETTINGS = ('user_agent', 'api_key', 'workspace_id', 'website')
+
+
+def read_settings(path):
+    """Read the known 'name = value' lines of a settings file, ignoring anything else."""
+    settings = {}
+    with open(path) as f:
+        for line in f:
+            name, sep, value = line.partition('=')
+            if sep and name.strip() in SETTINGS:
+                settings[name.strip()] = value.strip()
+    return settings
+
+
+def load_team(path='team.json'):
+    """Read the team's settings, a json file like
+    {"workspace_id": "1234567", "members": [{"user_agent": "a@b.com", "api_key": "..."}, ...]}
+
+    A member's own workspace_id overrides the team's. Each user_agent must appear once, as
+    the results are kept by it."""
+    with open(path) as f:
+        team = json.load(f)
+    members = []
+    for member in team['members']:
+        member = dict({'workspace_id': team.get('workspace_id')}, **member)
+        missing = [name for name in ('user_agent', 'api_key', 'workspace_id') if not member.get(name)]
+        if missing:
+            raise ValueError(f"A member of {path} is missing {', '.join(missing)}.")
+        if any(other['user_agent'] == str(member['user_agent']) for other in members):
+            raise ValueError(f"{member['user_agent']} is in {path} more than once.")
+        members.append({name: str(member[name]) for name in SETTINGS if name in member})
+    if not members:
+        raise ValueError(f"{path} has no members.")
+    return members
+
 
 class TimeLocal():
     """ The class to handle local machine tasks for timesheet app. """
 
-    def __init__(self):
-        
+    def __init__(self, client=None):
+        self.client = client or togglapi.default_client()   # shared connection pool
+
         # Declare initial user vairables
         self.user_agent, self.api_key, self.workspace_id, self.website, self.times = ('', '', '', '', None)
         
         # Load user details from settings file
         try:
-            with open('settings.txt') as f:
-                for line in f:
-                    fields = line.strip().split()
-                    # for security only input these pre-defined variables
-                    if fields[0] == 'user_agent' or 'api_key' or 'workspace_id' or 'website':
-                        # Handling the path on the computer needs special help
-                        exec('self.%s = "%s"' % (fields[0], fields[2]))
+            for name, value in read_settings('settings.txt').items():
+                setattr(self, name, value)
         
         # If it doesn't exist, prompt the user for the settings
         except FileNotFoundError:
@@ -43,14 +77,14 @@ class TimeLocal():
                 f.write('workspace_id = ' + str(self.workspace_id) +  '\n')
 
 
+    def project_index(self):
+        """The workspace's project and client index, cached next to settings.txt."""
+        return metadata.MetadataIndex(self.api_key, self.workspace_id, self.client)
+
+
     def get_workspace_id(self):
         # Gets list of workspaces user has from api
-        r = requests.get('https://api.track.toggl.com/api/v9/workspaces', auth=(self.api_key, 'api_token'))
-        r = r.json()
-        ids = []
-        for entry in r:
-            ids.append(str(entry['id']) + ' (' + entry['name'] + ')')
-        return ids 
+        return metadata.workspaces(self.api_key, self.client)
 
     def get_timesheet(self, date):
         """This is the master function to run to get a day's timesheet entry."""
@@ -63,24 +97,59 @@ class TimeLocal():
     def excelLoad(self):
         """Copy the timesheet data rows to the clipboard, excluding the header."""
         try:
-            # Then re-order
-            self.times_updated = self.times[['Date', 'Branch', 'Charge Type', 'Project No', 'Job No', 'Description', 'Hours']]
-            
-            # Copy data to clipboard without the header
-            self.times_updated.to_clipboard(index=False, header=False, excel=True)
+            with timing.phase('excelLoad'):
+                # Then re-order
+                self.times_updated = self.times.to_df()[COLUMNS]
+
+                # Copy data to clipboard without the header
+                self.times_updated.to_clipboard(index=False, header=False, excel=True)
             print('Data rows copied to clipboard. You can now paste them into your Excel workbook.')
         except Exception as e:
             print(f'ERROR: Unable to copy data to clipboard. {e}')
 
 
     def display_data(self):
-        # Show from Pandas dataframe
-        # Make a copy of the DataFrame limited to a certain number of characters
-        times_copy = self.times.copy()
+        # Show the timesheet table, limiting the "Description" column to no more than 60 characters and adding "..." if it was cut off
+        with timing.phase('display_data'):
+            print('')
+            print(self.times.to_string(max_width=60))
+            print('')
+
+
+def sheet_title(title):
+    """Make a string safe to use as an Excel sheet name."""
+    return re.sub(r'[\[\]:*?/\\]', '-', title)[:31]
+
+
+def week_sheets(days):
+    """Group (DD/MM/YY date, rows) pairs, in date order, into one (sheet title, rows) pair per week."""
+    week, rows = None, []
+    for date, day_rows in days:
+        monday = datetime.strptime(date, '%d/%m/%y').date()
+        monday -= timedelta(days=monday.weekday())
+        if week is not None and monday != week:
+            yield 'Week ' + week.isoformat(), rows
+            rows = []
+        week = monday
+        rows.extend(day_rows)
+    if week is not None:
+        yield 'Week ' + week.isoformat(), rows
+
+
+def export_workbook(path, sheets):
+    """Write (sheet title, rows) pairs to an .xlsx file, in the column order of excelLoad.
 
-        # Limit the "Description" column to no more than 30 characters and add "..." if it was cut off
-        times_copy["Description"] = times_copy["Description"].apply(lambda x: (x[:57] + "...") if isinstance(x, str) and len(x) > 60 else x)
+    openpyxl's write-only workbook streams rows out as they are added, so sheets can be a
+    generator and only the sheet being written is held in memory."""
+    from openpyxl import Workbook
 
-        print('')
-        print(times_copy.to_string(index=False))
-        print('')
\ No newline at end of file
+    with timing.phase('export_workbook'):
+        workbook = Workbook(write_only=True)
+        for title, rows in sheets:
+            sheet = workbook.create_sheet(sheet_title(title))
+            sheet.append(COLUMNS)
+            for row in rows:
+                sheet.append([float(row[column]) if column == 'Hours' else row[column] for column in COLUMNS])
+        if not workbook.worksheets:
+            workbook.create_sheet('No entries').append(COLUMNS)
+        workbook.save(path)
@@ -1,11 +1,22 @@
 import re
+import hashlib
 import json
 import logging
 import os.path
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import numpy as np
-import pandas as pd
-import requests
+import projectcodes
+import rounding
+import timing
+import togglapi
+from projectcodes import WrongProjectNameFormatException
+from togglapi import TogglApiException
+
+REPORTS_PATH = '/reports/api/v2/details'
+ENTRY_FIELDS = ['pid', 'project', 'client', 'tags', 'description', 'dur', 'start']  # fields of a report entry that are used
+VALID_TAGS = ["LABOUR-ENG", "LEAVE", "NR-ADMIN", "NR-ENGQUOT"]
 
 
 class MissingChargeTypeException(Exception):
@@ -16,10 +27,6 @@ class MissingProjectException(Exception):
     """Exception raised for missing project."""
     pass
 
-class WrongProjectNameFormatException(Exception):
-    """Exception raised for wrong project name format."""
-    pass
-
 class NoDayDataException(Exception):
     """Exception raised for no data on day selected."""
     pass
@@ -32,10 +39,120 @@ class DuplicateValidTagException(Exception):
     """Exception raised for duplicate valid tags."""
     pass
 
+TIMESHEET_EXCEPTIONS = (DuplicateValidTagException, MissingChargeTypeException, MissingProjectException, WrongProjectNameFormatException, NoDayDataException, DateOutOfRangeException, TogglApiException)
+
+def intern(text):
+    """Intern a string so every entry with it shares one copy, leaving None as it is."""
+    return sys.intern(text) if isinstance(text, str) else text
+
+
+class EntryStore():
+    """ Report entries kept as columns, for long ranges.
+
+    Only the fields in ENTRY_FIELDS are kept. Projects, clients, tags and descriptions are
+    interned so repeated ones share one string, each distinct set of tags is one shared tuple
+    and durations are an integer array, so an entry costs a few pointers rather than a dict
+    of every field Toggl returns.
+    """
+
+    __slots__ = ('pids', 'projects', 'clients', 'tags', 'descriptions', 'durations', 'starts', 'tag_sets')
+
+    def __init__(self, entries=(), tag_sets=None):
+        self.pids = []
+        self.projects = []
+        self.clients = []
+        self.tags = []
+        self.descriptions = []
+        self.durations = array('q')   # ms
+        self.starts = []
+        self.tag_sets = {} if tag_sets is None else tag_sets  # tags tuple -> the shared copy, can be shared between stores
+        for entry in entries:
+            self.append(entry)
+
+
+    def __len__(self):
+        return len(self.durations)
+
+
+    def __eq__(self, other):
+        # Equal to another store or a list of report entries with the same kept fields
+        if isinstance(other, EntryStore):
+            other = other.to_entries()
+        return self.to_entries() == other
+
+
+    def append(self, entry):
+        """Add a report entry."""
+        tags = tuple(intern(tag) for tag in entry['tags'] or ())
+        self.pids.append(entry.get('pid'))
+        self.projects.append(intern(entry['project']))
+        self.clients.append(intern(entry['client']))
+        self.tags.append(self.tag_sets.setdefault(tags, tags))
+        self.descriptions.append(intern(entry['description']))
+        self.durations.append(entry['dur'])
+        self.starts.append(entry['start'])
+
+
+    def to_entries(self):
+        """The entries as report entry dicts, e.g. to cache them."""
+        return [dict(zip(ENTRY_FIELDS, (pid, project, client, list(tags), description, dur, start)))
+                for pid, project, client, tags, description, dur, start in
+                zip(self.pids, self.projects, self.clients, self.tags, self.descriptions, self.durations, self.starts)]
+
+
+class TimeTable():
+    """ Timesheet rows as a list of dicts, in the column order of the Excel timesheet.
+
+    Pandas is only imported if a DataFrame is asked for with to_df().
+    """
+
+    columns = ['Date', 'Branch', 'Charge Type', 'Project No', 'Job No', 'Description', 'Hours']
+
+    def __init__(self, rows=None):
+        self.rows = rows or []
+
+
+    def __len__(self):
+        return len(self.rows)
+
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+    def to_records(self):
+        """Rows as a list of dicts, like DataFrame.to_dict('records')."""
+        return self.rows
+
+
+    def to_df(self):
+        """Build a Pandas DataFrame of the rows."""
+        import pandas as pd
+        return pd.DataFrame(self.rows, columns=self.columns)
+
+
+    def to_string(self, max_width=None):
+        """Format the rows as a right aligned text table, cutting long cells to max_width characters."""
+        cells = [[str(row[column]) for column in self.columns] for row in self.rows]
+        if max_width:
+            cells = [[(x[:max_width - 3] + "...") if len(x) > max_width else x for x in line] for line in cells]
+        widths = [max([len(column)] + [len(line[i]) for line in cells]) for i, column in enumerate(self.columns)]
+        lines = [self.columns] + cells
+        return '\n'.join(' '.join(x.rjust(widths[i]) for i, x in enumerate(line)) for line in lines)
+
+
 class TimeLogic():
     """ The class to handle the logic of collecting the timesheets. """
 
-    def __init__(self,togglapikey, email, workspace_ID):
+    page_workers = 4    # report pages fetched at the same time
+    stream_days = 32    # ranges this long are streamed rather than fetched whole
+
+    def __init__(self,togglapikey, email, workspace_ID, client=None, cache=None, parser=None, metadata=None):
+        self.client = client or togglapi.default_client()   # shared connection pool
+        self.cache = cache  # optional daycache.DayCache
+        self.parser = parser or projectcodes.default_parser()   # project name rules
+        self.metadata = metadata    # optional metadata.MetadataIndex to look projects up by id
+        self.cache_user = hashlib.sha256(togglapikey.encode()).hexdigest()[:16] if togglapikey else ''    # cache by api key so users can't see each other's days
         self.api_key = togglapikey # for api
         self.user_agent = email # for api
         self.workspace_id = workspace_ID # for api
@@ -46,30 +163,125 @@ class TimeLogic():
 
     def get_detailed_data(self, date):
         """Get detailed data for a specific date from toggl api"""
-        # Format date required by Toggl api
+        return {'data': next(iter(self.get_detailed_range(date, date).values()))}  # keyed by the padded date
+
+
+    def get_detailed_range(self, since, until):
+        """Get detailed data for every day from since to until (DD/MM/YY), grouped by day.
+
+        Days found in the cache are not fetched again, the rest are fetched together in one
+        report and cached. Each day's entries are an EntryStore, empty if it has none."""
+        start, end = self.parse_range(since, until)
+
+        days = {}
+        day = start
+        while day <= end:
+            cached = self.cache.get(self.workspace_id, self.cache_user, day) if self.cache else None
+            days[day] = EntryStore(cached) if cached is not None else None
+            day += timedelta(days=1)
+
+        # Fetch the span of days that were not cached
+        missing = [day for day, entries in days.items() if entries is None]
+        if missing:
+            fetched = self.fetch_range(missing[0], missing[-1])
+            for day in missing:
+                days[day] = fetched[day]
+                if self.cache:
+                    self.cache.put(self.workspace_id, self.cache_user, day, fetched[day].to_entries())
+
+        return {day.strftime('%d/%m/%y'): entries for day, entries in days.items()}
+
+
+    def parse_range(self, since, until):
+        """Convert a DD/MM/YY date range to dates."""
         try:
-            date = datetime.strptime(date, '%d/%m/%y').strftime('%Y-%m-%d')
+            start = datetime.strptime(since, '%d/%m/%y').date()
+            end = datetime.strptime(until, '%d/%m/%y').date()
         except ValueError:
             raise DateOutOfRangeException(f"This date does not exist. Please check and try again.")
-        # Set paramaters for api call
-        parameters = {
+        if end < start:
+            raise DateOutOfRangeException(f"The end date is before the start date. Please check and try again.")
+        return start, end
+
+
+    def fetch_range(self, start, end):
+        """Get detailed data from toggl api for every day from start to end (dates), as an EntryStore per day.
+
+        All pages of the report are fetched, the first to learn the page count and the
+        rest in parallel. Each page is put into the day stores as it arrives."""
+        # Group entries by the day they started on
+        tag_sets = {}
+        days = {}
+        day = start
+        while day <= end:
+            days[day.isoformat()] = EntryStore(tag_sets=tag_sets)
+            day += timedelta(days=1)
+
+        def add(page):
+            for entry in page['data']:
+                store = days.get(entry['start'][:10])
+                if store is not None:
+                    store.append(entry)
+
+        parameters = self.report_parameters(start, end)
+        # First page tells us how many pages there are
+        first = self.get_report_page(parameters, 1)
+        add(first)
+        pages = self.page_count(first)
+        if pages > 1:
+            # Overlap the remaining page requests, keeping them in page order
+            with ThreadPoolExecutor(max_workers=min(self.page_workers, pages - 1)) as pool:
+                for page in pool.map(lambda n: self.get_report_page(parameters, n), range(2, pages + 1)):
+                    add(page)
+        return {datetime.strptime(day, '%Y-%m-%d').date(): store for day, store in days.items()}
+
+
+    def iter_entries(self, start, end):
+        """Yield the report's entries from start to end (dates) a page at a time, in start order.
+
+        The next page is fetched while the current one is used, so no more than two pages
+        are held however long the range is."""
+        parameters = dict(self.report_parameters(start, end), order_field='date', order_desc='off')
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            page_no, pages = 1, 1
+            future = pool.submit(self.get_report_page, parameters, 1)
+            while page_no <= pages:
+                page = future.result()
+                pages = self.page_count(page)
+                if page_no < pages:
+                    future = pool.submit(self.get_report_page, parameters, page_no + 1)
+                yield from page['data']
+                page_no += 1
+
+
+    def report_parameters(self, start, end):
+        """Paramaters for the detailed report api call from start to end (dates)."""
+        return {
         'user_agent': self.user_agent,
         'workspace_id':self.workspace_id,
-        'since': date,
-        'until': date,
+        'since': start.strftime('%Y-%m-%d'),
+        'until': end.strftime('%Y-%m-%d'),
         'tag_ids': '',
         }
-        # Get data from api
-        r = requests.get('https://api.track.toggl.com/reports/api/v2/details', auth=(self.api_key, 'api_token'), params=parameters)
-        
-        return r.json()  
+
+
+    def page_count(self, page):
+        """Number of pages in the report, from the total_count and per_page of any page."""
+        per_page = page.get('per_page') or len(page['data'])
+        total_count = page.get('total_count') or len(page['data'])
+        return -(-total_count // per_page) if per_page else 1
+
+
+    def get_report_page(self, parameters, page):
+        """Get one page of the detailed report from toggl api"""
+        with timing.phase('get_detailed_data'):
+            return self.client.get(REPORTS_PATH, self.api_key, dict(parameters, page=page))
 
 
     # Define functions for interpreting the data
     def round_half_hr(self, time_ms):
         """Toggl api returns milliseconds, round to half hours"""
-        time = time_ms/(1000*60*60)
-        return round(time * 2) / 2
+        return rounding.round_half_hr(time_ms)
 
 
     def format_date_text(self, date):
@@ -80,198 +292,292 @@ class TimeLogic():
         return datetime.strptime(date, '%d/%m/%y').date()
        
 
-    def summary_data(self, date):
-        """Get detailed data and summarises to required format for timesheet."""
+    def summary_range(self, since, until):
+        """Summarise every day from since to until (DD/MM/YY) with one fetch for the whole range.
+
+        Ranges of stream_days or more are streamed instead of fetched whole (see summary_stream)."""
+        try:
+            start, end = self.parse_range(since, until)
+            if (end - start).days + 1 >= self.stream_days:
+                return {"status": "success", "days": dict(self.summary_stream(since, until))}
+            days = self.get_detailed_range(since, until)
+        except (DateOutOfRangeException, TogglApiException) as e:
+            return {"status": "error", "error": str(e)}
+        except Exception as e:
+            return {"status": "error", "error": f"An unexpected error occurred: {str(e)}"}
+        return {"status": "success", "days": self.summary_days(days)}
+
+
+    def summary_days(self, days):
+        """Summarise several fetched days ({date: entries}) like summary_data, rounding all their times in one batch."""
+        results = {}
+        aggregated = {}
+        for date, entries in days.items():
+            try:
+                if len(entries) == 0:
+                    raise NoDayDataException(f"There is no timesheet data entered for this day.")
+                with timing.phase('summary_data'):
+                    aggregated[date] = self.aggregate_entries(entries)
+            except Exception as e:
+                results[date] = self.error_result(e, date)
+
+        with timing.phase('round_times'):
+            rounded = rounding.round_days([project_tag_times for rows, project_tag_times in aggregated.values()])
+        for (date, (rows, project_tag_times)), (project_tag_times_rounded, actual_total_hours_nearest) in zip(aggregated.items(), rounded):
+            try:
+                results[date] = self.finish_summary(date, rows, project_tag_times_rounded, actual_total_hours_nearest)
+            except Exception as e:
+                results[date] = self.error_result(e, date)
+        return {date: results[date] for date in days}
+
+
+    def summary_stream(self, since, until):
+        """Summarise every day from since to until (DD/MM/YY), yielding (date, result) a day at a time.
+
+        Entries are streamed from the api so only one day's entries are held at once, for
+        ranges too long to fetch in one go. Like get_detailed_range, days found in the cache
+        are read from it and only the span of days that were not is streamed. Fetched days are
+        written to the cache."""
+        start, end = self.parse_range(since, until)
+        cached = self.cache.fresh_days(self.workspace_id, self.cache_user, start, end) if self.cache else set()
+        missing = [start + timedelta(days=n) for n in range((end - start).days + 1) if start + timedelta(days=n) not in cached]
+        entries = self.iter_entries(missing[0], missing[-1]) if missing else iter(())
+        entry = next(entries, None)
+        tag_sets = {}
+        day = start
+        while day <= end:
+            date = day.strftime('%d/%m/%y')
+            if missing and missing[0] <= day <= missing[-1]:
+                # Collect the day's entries, which arrive in start order
+                day_entries = EntryStore(tag_sets=tag_sets)
+                while entry is not None and entry['start'][:10] <= day.isoformat():
+                    if entry['start'][:10] == day.isoformat():
+                        day_entries.append(entry)
+                    entry = next(entries, None)
+                if self.cache:
+                    self.cache.put(self.workspace_id, self.cache_user, day, day_entries.to_entries())
+            else:
+                stored = self.cache.get(self.workspace_id, self.cache_user, day)
+                # Fetched on its own if it went stale since fresh_days
+                day_entries = EntryStore(stored, tag_sets) if stored is not None else self.get_detailed_range(date, date)[date]
+            yield date, self.summary_data(date, {'data': day_entries})
+            day += timedelta(days=1)
+
+
+    def validate_range(self, since, until):
+        """Check every entry from since to until (DD/MM/YY) without summarising.
+
+        The range is fetched once (streamed if it is stream_days or longer) and each entry is
+        checked against the tag and project name rules, so every problem is found in one go.
+        The cache is not read, as the user is checking entries they have just fixed, but the
+        fetched days are written to it.
+        Returns {date: [problem, ...]} for the days with problems, each problem being the
+        entry's 'description', 'start', 'hours' and 'errors'."""
+        try:
+            start, end = self.parse_range(since, until)
+            if (end - start).days + 1 >= self.stream_days:
+                entries = self.iter_entries(start, end)
+            else:
+                days = self.fetch_range(start, end)
+                if self.cache:
+                    for day, store in days.items():
+                        self.cache.put(self.workspace_id, self.cache_user, day, store.to_entries())
+                entries = (entry for store in days.values() for entry in store.to_entries())
+            problems = {}
+            with timing.phase('validate'):
+                for entry in entries:
+                    errors = self.entry_errors(entry)
+                    if errors:
+                        date = datetime.strptime(entry['start'][:10], '%Y-%m-%d').strftime('%d/%m/%y')
+                        problems.setdefault(date, []).append({'description': entry['description'], 'start': entry['start'],
+                                                              'hours': self.round_half_hr(entry['dur']), 'errors': errors})
+        except (DateOutOfRangeException, TogglApiException) as e:
+            return {"status": "error", "error": str(e)}
+        except Exception as e:
+            return {"status": "error", "error": f"An unexpected error occurred: {str(e)}"}
+        return {"status": "success", "problems": problems}
+
+
+    def entry_errors(self, entry):
+        """Everything wrong with one entry, with the same messages summary_data stops at."""
+        errors = []
+        matching_tags = [tag for tag in entry['tags'] or () if tag in VALID_TAGS]
+        if len(matching_tags) > 1:
+            errors.append(f"Multiple valid tags for entry \"{entry['description']}\". Please fix and try again.")
+        elif len(matching_tags) == 0:
+            errors.append(f"Missing charge type tag for entry \"{entry['description']}\". Please fix and try again.")
+        if entry['project'] is None:
+            errors.append(f"One of your entries is missing a project. Please fix and try again.")
+        else:
+            known = self.metadata.project(entry.get('pid')) if self.metadata else None
+            if known and known['name'] == entry['project']:
+                error = known['error']
+            else:
+                codes, error = self.parser.parse_cached(entry['project'])
+            if error:
+                errors.append(error)
+        return errors
+
+
+    def summary_data(self, date, r_dat=None):
+        """Get detailed data and summarises to required format for timesheet.
+
+        r_dat can be passed in if the day has already been fetched (e.g. by summary_range)."""
         try:        
             # Get detailed timesheet
-            r_dat = self.get_detailed_data(date)
+            if r_dat is None:
+                r_dat = self.get_detailed_data(date)
             # If r_dat is empty (i.e., no entries), let user know and stop the process
-            if r_dat['data'] == []:
+            if len(r_dat['data']) == 0:
                 raise NoDayDataException(f"There is no timesheet data entered for this day.")
-            # Create a new variable for summarised data
-            r_dat2 = {'data': []}
-            # Save the date in the new variable
-            r_dat2['date'] = date
 
-            # Get a list of the unique project/tag combinations as a list of dictionaries
-            projects_list = []
-            valid_tags = ["LABOUR-ENG", "LEAVE", "NR-ADMIN", "NR-ENGQUOT"]
+            # Summarise the entries into one row per project/tag combination
+            with timing.phase('summary_data'):
+                rows, project_tag_times = self.aggregate_entries(r_dat['data'])
+            with timing.phase('round_times'):
+                project_tag_times_rounded, actual_total_hours_nearest = self.round_times(project_tag_times)
+            return self.finish_summary(date, rows, project_tag_times_rounded, actual_total_hours_nearest)
 
-            try:
-                for i in r_dat['data']:
-                    # Consider both project and tag for uniqueness
-                    valid_tag = None
-                    matching_tags = [tag for tag in i['tags'] if tag in valid_tags]
-                    
-                    # If more than one valid tag matches, raise an exception
-                    if len(matching_tags) > 1:
-                        raise DuplicateValidTagException(f"Multiple valid tags for entry \"{i['description']}\". Please fix and try again.")
-                    
-                    # If exactly one valid tag matches, assign it
-                    elif len(matching_tags) == 1:
-                        valid_tag = matching_tags[0]
-                    
-                    # If no valid tags match, skip this entry (or handle as needed)
-                    else:
-                        raise MissingChargeTypeException(f"Missing charge type tag for entry \"{i['description']}\". Please fix and try again.")
-
-                    # Create the project/tag combination dictionary and add it to the list if unique
-                    project_tag_combination = {'project': i['project'], 'tag': valid_tag}
-                    if project_tag_combination not in projects_list:
-                        projects_list.append(project_tag_combination)
-                        
-            except KeyError:
-                raise KeyError
-            
-            # Create base dataframe with above for timesheet
-            for entry in projects_list:
-                #entry = entry[0]
-                if entry['project'] is None:
-                    raise MissingProjectException(f"One of your entries is missing a project. Please fix and try again.")
-                elif entry['project'] == 'NR':
-                    r_dat2['data'].append({'project': entry['project'], 'project_short': '', 'W': '', 'charge_type': entry['tag']}) 
-                else:
-                    try:
-                        # Extract project number and job number
-                        project_parts = entry['project'].split(' - ')
-                        project_no = project_parts[0].split('/')[0].strip()
-                        if project_no[0:2] != 'P-':
-                            project_no = 'PRO' + project_no[1:4] + '-' + project_no[4:]
-                        job_no = project_parts[0].split('/')[1].strip()
-                        if job_no[0] != 'J':
-                            job_no = 'WIP' + job_no[1:4] + '-' + job_no[4:]
-                    except IndexError:
-                        raise WrongProjectNameFormatException(f"The project name \"{entry['project']}\" has not followed the correct formatting. Please fix and try again.")
-
-                    # Validate project and job number formats
-                    if not (re.match(r'[A-Z]-\d[A-Z]{3}-\d{3}', project_no) or re.match(r'[A-Z]{3}\d{3}', project_no)):
-                        raise WrongProjectNameFormatException(f"The project name \"{project_no}\" has not followed the correct formatting. Please fix and try again.")
-                    if not (re.match(r'[A-Z]{3}-\d{3}', job_no) or re.match(r'[A-Z]{3}\d{3}', job_no)):
-                        raise WrongProjectNameFormatException(f"The job number \"{job_no}\" in Toggl should be a) [J][2xletter]-[3xdigit], or b) W[3xdigit]")
-
-                    r_dat2['data'].append({'project': entry['project'], 'project_short': project_no, 'W': job_no, 'charge_type': entry['tag']})
-
-            # Add formatted data
-            b_times = []
-            for x in r_dat2['data']:
-                x['client'] = ''
-                for i in r_dat['data']:
-                    if x['project'] == i['project']:
-                        # Add client
-                        if i['client'] != x['client']:
-                            x['client'] = i['client']
-
-                # Aggregate time (ms) by project_tag_combination
-                project_tag_times = {}
-                for entry in r_dat['data']:
-                    tag = entry['tags'][0] if entry.get('tags') else 'NoTag'
-                    key = (entry['project'], tag)
-                    project_tag_times[key] = project_tag_times.get(key, 0) + entry['dur']
-
-                # Add comments with time if more than one comment. Store descriptions to 'temp_desc' and time to 'temp_desc_time'.
-                x['temp_desc'] = []
-                x['temp_desc_time'] = []
-                for i in r_dat['data']:
-                    if x['project'] == i['project'] and x['charge_type'] == i['tags'][0]:
-                        if i['description'] not in x['temp_desc']:
-                            x['temp_desc'].append(i['description'])
-                            x['temp_desc_time'].append(i['dur'])
-                        # If there are repeats of descriptions, sum the time.
-                        else:
-                            idx = x['temp_desc'].index(i['description'])
-                            x['temp_desc_time'][idx] += i['dur']
-
-                # Write complete description string with time to x['description'].
-                x['description'] = []
-                for idx in range(len(x['temp_desc'])):
-                    # Only show sub-time if does not round to 0.0hrs
-                    if self.round_half_hr(x['temp_desc_time'][idx]) > 0:
-                        # Don't include the time in the first description
-                        if idx == 0:
-                            x['description'].append(x['temp_desc'][idx])
-                        # Otherwise add the time of future descriptions
-                        else:
-                            x['description'].append(x['temp_desc'][idx] + ' (' + str(self.round_half_hr(x['temp_desc_time'][idx])) + 'hr)')
-
-                # Get output description string
-                if x['project'] == 'NR' and x['charge_type'] == i['tags'][0]:
-                    description = ', '.join(x['description'])
-                else:
-                    description = '(' + x['client'] + ') ' + ', '.join(x['description'])
-                x['output_desc'] = description
-
-                # Set branch to an empty string
-                x['branch'] = ''
-
-                # No need to update format for project_short and W as it's not required
-
-            # Now doing times
-            # First, calculate the sum of actual unrounded hours
-            actual_total_hours_unrounded = sum(time_ms for time_ms in project_tag_times.values()) / (1000 * 60 * 60)
-
-            # Then, round this sum to the nearest half-hour if necessary
-            actual_total_hours_nearest = round(actual_total_hours_unrounded * 2) / 2
-
-            # Round each project_tag_combination total time to the nearest half-hour
-            project_tag_times_rounded = project_tag_times.copy()
-            for key, time_ms in project_tag_times_rounded.items():
-                hours = time_ms / (1000 * 60 * 60)  # Convert ms to hours
-                project_tag_times_rounded[key] = round(hours * 2) / 2  # Round to nearest half-hour
-
-            actual_total_hours_rounded = sum(project_tag_times_rounded.values())
-
-            # Assuming the discrepancy must be resolved in half-hour increments
-            if actual_total_hours_rounded != actual_total_hours_nearest:
-                discrepancy = actual_total_hours_nearest - actual_total_hours_rounded
-                discrepancy_sign = discrepancy / abs(discrepancy)
-                adjustments_needed = int(discrepancy * 2)  # Convert to how many half-hours need adjusting
-
-                # Sort entries by rounded time descending, so we start adjustment from the largest
-                sorted_keys = sorted(project_tag_times_rounded, key=project_tag_times_rounded.get, reverse=True)
-                for key in sorted_keys:
-                    if adjustments_needed == 0:
-                        break  # Stop if no more adjustments are needed
-                    # Ensure we don't reduce below 0 hours to maintain minimum billing increments
-                    if project_tag_times_rounded[key] >= 0.5:
-                        project_tag_times_rounded[key] += 0.5 * discrepancy_sign  # Increase or reduce the time based on the value of discrepancy
-                        adjustments_needed -= 1 * discrepancy_sign  # Decrement the needed adjustments the correct way
-
-            # Update r_dat2 with times
-            for entry in r_dat2['data']:
-                # Create a key based on the project and charge_type
-                project = entry['project']
-                charge_type = entry['charge_type']
-                key = (project, charge_type)
-
-                # Find the corresponding rounded time and insert it into the entry
-                if key in project_tag_times_rounded:
-                    entry['time_rounded'] = project_tag_times_rounded[key]
-                else:
-                    entry['time_rounded'] = 0  # or handle as appropriate if the key is not found
-
-            # Filter out entries with time_rounded == 0
-            r_dat2['data'] = [entry for entry in r_dat2['data'] if entry['time_rounded'] > 0]
-
-            self.actual_total_hours_nearest = actual_total_hours_nearest    # save as variable to report later
-
-            # Advise user if no timesheet entries
-            if len(r_dat2['data']) == 0:
-                self.notimesheetentries = True
-                pass
+        except Exception as e:
+            return self.error_result(e, date)
 
-            # Save as Pandas dataframe
+
+    def finish_summary(self, date, rows, project_tag_times_rounded, actual_total_hours_nearest):
+        """Put the rounded times into a day's rows and make the timesheet table."""
+        # Update rows with times
+        for entry in rows:
+            # Find the corresponding rounded time and insert it into the entry
+            key = (entry['project'], entry['charge_type'])
+            entry['time_rounded'] = project_tag_times_rounded.get(key, 0)
+
+        # Filter out entries with time_rounded == 0
+        r_dat2 = {'date': date, 'data': [entry for entry in rows if entry['time_rounded'] > 0]}
+
+        self.actual_total_hours_nearest = actual_total_hours_nearest    # save as variable to report later
+
+        # Advise user if no timesheet entries
+        self.notimesheetentries = len(r_dat2['data']) == 0
+
+        # Save as timesheet table
+        with timing.phase('create_df'):
             self.times = self.create_df(r_dat2)
-            return {"status": "success", "data": self.times}
-        
-        except (DuplicateValidTagException, MissingChargeTypeException, MissingProjectException, WrongProjectNameFormatException, NoDayDataException, DateOutOfRangeException) as e:
+        return {"status": "success", "data": self.times}
+
+
+    def error_result(self, e, date=None):
+        """The result returned for an exception raised while summarising a day (DD/MM/YY).
+
+        A day whose entries have a problem is dropped from the cache, so it is fetched again
+        once the user has fixed it."""
+        if self.cache and date and not isinstance(e, (NoDayDataException, DateOutOfRangeException, TogglApiException)):
+            try:
+                self.cache.forget(self.workspace_id, self.cache_user, self.format_date_date(date))
+            except ValueError:
+                pass
+        if isinstance(e, TIMESHEET_EXCEPTIONS):
             return {"status": "error", "error": str(e)}
+        return {"status": "error", "error": f"An unexpected error occurred: {str(e)}"}
+
+
+    def aggregate_entries(self, entries):
+        """Summarise a day's entries (an EntryStore or a list of report entries) in a single pass.
+
+        Returns the timesheet rows (one per project/charge type, in order first seen) and
+        the total time (ms) per project and first tag."""
+        combinations = {}       # (project, valid tag) in order first seen, dict used as an ordered set
+        clients = {}            # project -> client of its last entry
+        pids = {}               # project -> project id
+        project_tag_times = {}  # (project, first tag) -> total ms
+        descriptions = {}       # (project, first tag) -> {description: total ms} in order first seen
+        last_tag = None
+
+        if not isinstance(entries, EntryStore):
+            entries = EntryStore(entries)
+        for pid, project, client, tags, description, dur in zip(entries.pids, entries.projects, entries.clients,
+                                                               entries.tags, entries.descriptions, entries.durations):
+            # Consider both project and tag for uniqueness
+            matching_tags = [tag for tag in tags if tag in VALID_TAGS]
+            
+            # If more than one valid tag matches, raise an exception
+            if len(matching_tags) > 1:
+                raise DuplicateValidTagException(f"Multiple valid tags for entry \"{description}\". Please fix and try again.")
+            # If no valid tags match, raise an exception
+            elif len(matching_tags) == 0:
+                raise MissingChargeTypeException(f"Missing charge type tag for entry \"{description}\". Please fix and try again.")
+            combinations[(project, matching_tags[0])] = None
+
+            clients[project] = client
+            pids[project] = pid
+
+            # Times and descriptions are grouped by the entry's first tag
+            tag = tags[0]
+            key = (project, tag)
+            project_tag_times[key] = project_tag_times.get(key, 0) + dur
+            bucket = descriptions.setdefault(key, {})
+            bucket[description] = bucket.get(description, 0) + dur
+            last_tag = tag
+
+        # Create base rows with the project and job numbers
+        known = {}
+        rows = []
+        for project, tag in combinations:
+            if project is None:
+                raise MissingProjectException(f"One of your entries is missing a project. Please fix and try again.")
+            # Use the project's details from the metadata index if it has them, otherwise parse the name
+            if project not in known:
+                known[project] = self.metadata.project(pids[project]) if self.metadata else None
+                if known[project] and known[project]['name'] != project:
+                    known[project] = None   # renamed since the index was fetched
+            if known[project]:
+                if known[project]['error']:
+                    raise WrongProjectNameFormatException(known[project]['error'])
+                project_no, job_no = known[project]['project_no'], known[project]['job_no']
+            else:
+                project_no, job_no = self.parse_project(project)    # ('', '') for NR
+            rows.append({'project': project, 'project_short': project_no, 'W': job_no, 'charge_type': tag})
+
+        # Add formatted descriptions
+        for x in rows:
+            x['client'] = known[x['project']]['client'] if known[x['project']] else clients[x['project']]
+
+            # Add comments with time if more than one comment
+            x['description'] = []
+            for idx, (text, time_ms) in enumerate(descriptions.get((x['project'], x['charge_type']), {}).items()):
+                # Only show sub-time if does not round to 0.0hrs
+                if self.round_half_hr(time_ms) > 0:
+                    # Don't include the time in the first description
+                    if idx == 0:
+                        x['description'].append(text)
+                    # Otherwise add the time of future descriptions
+                    else:
+                        x['description'].append(text + ' (' + str(self.round_half_hr(time_ms)) + 'hr)')
 
-        except Exception as e:
-            return {"status": "error", "error": f"An unexpected error occurred: {str(e)}"}
+            # Get output description string, NR rows tagged like the day's last entry have no client
+            if x['project'] in self.parser.no_codes and x['charge_type'] == last_tag:
+                x['output_desc'] = ', '.join(x['description'])
+            else:
+                x['output_desc'] = '(' + x['client'] + ') ' + ', '.join(x['description'])
+
+            # Set branch to an empty string
+            x['branch'] = ''
+
+        return rows, project_tag_times
+
+
+    def parse_project(self, project):
+        """Split a Toggl project name into its project number and job number."""
+        return self.parser.parse(project)
+
+
+    def round_times(self, project_tag_times):
+        """Round each total (ms) to the nearest half hour, keeping the day total rounded as a whole.
+
+        Returns the rounded hours per key and the day's total hours."""
+        return rounding.round_day(project_tag_times)
 
     
     def create_df(self, r_dat2):
-        """Create Pandas dataframe with data."""
+        """Create the timesheet table with data, sorted by project number."""
         data = []
         for i in r_dat2['data']:
             data.append({'Date': self.format_date_text(r_dat2['date']), 
@@ -281,7 +587,6 @@ class TimeLogic():
                 'Job No': i['W'], 
                 'Description': i['output_desc'], 
                 'Hours': str(i['time_rounded'])})
-        dataframe = pd.DataFrame(data)
-        # Sort the DataFrame by 'Project No'
-        dataframe = dataframe.sort_values(by='Project No', ascending=False)
-        return dataframe
\ No newline at end of file
+        # Sort by 'Project No'
+        data.sort(key=lambda row: row['Project No'], reverse=True)
+        return TimeTable(data)
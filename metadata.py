@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import projectcodes
+import togglapi
+
+logger = logging.getLogger('togglcon.metadata')
+
+
+def default_dir():
+    """Keep the metadata next to settings.txt, or in /tmp on AWS Lambda."""
+    if 'AWS_EXECUTION_ENV' in os.environ:
+        return '/tmp'
+    return '.'
+
+
+def user_hash(togglapikey):
+    return hashlib.sha256(togglapikey.encode()).hexdigest()[:16]
+
+
+class MetadataIndex():
+    """ A workspace's projects and clients, fetched via api v9 and cached in a json file.
+
+    Each project's client and parsed project/job numbers are worked out once when the index
+    is fetched, so summarising a day looks them up by project id. The file is refetched once
+    it is older than max_age, or when an unknown project id turns up (at most once every
+    min_refresh seconds).
+    """
+
+    def __init__(self, togglapikey, workspace_ID, client=None, directory=None, parser=None, max_age=24 * 60 * 60, min_refresh=5 * 60):
+        self.api_key = togglapikey
+        self.workspace_id = str(workspace_ID)
+        self.client = client or togglapi.default_client()
+        self.parser = parser or projectcodes.default_parser()
+        self.path = os.path.join(directory or default_dir(), f'metadata_{self.workspace_id}_{user_hash(togglapikey)}.json')
+        self.max_age = max_age
+        self.min_refresh = min_refresh
+        self.projects = None    # project id -> {'name', 'client', 'project_no', 'job_no', 'error'}
+        self.fetched = 0
+        self.lock = threading.Lock()
+
+
+    def load(self):
+        """Load the index from its file, or fetch it if the file is missing or too old."""
+        with self.lock:
+            if self.projects is None:
+                try:
+                    with open(self.path) as f:
+                        saved = json.load(f)
+                    self.projects = self.parse_codes({int(pid): project for pid, project in saved['projects'].items()})
+                    self.fetched = saved['fetched']
+                except (OSError, ValueError, KeyError):
+                    self.projects = {}
+            if time.time() - self.fetched > self.max_age:
+                self.try_refresh()
+        return self
+
+
+    def refresh(self):
+        """Fetch the projects and clients from the api and save them."""
+        clients = {c['id']: c['name'] for c in self.get_all(f'/api/v9/workspaces/{self.workspace_id}/clients')}
+        projects = {p['id']: {'name': p['name'], 'client': clients.get(p.get('client_id'))}
+                    for p in self.get_all(f'/api/v9/workspaces/{self.workspace_id}/projects', {'active': 'both'})}
+        self.fetched = time.time()
+        with open(self.path, 'w') as f:
+            json.dump({'fetched': self.fetched, 'projects': projects}, f)
+        self.projects = self.parse_codes(projects)
+
+
+    def try_refresh(self):
+        """Refresh, keeping what we have if the api fails. Projects not found are then parsed by name."""
+        try:
+            self.refresh()
+        except togglapi.TogglApiException:
+            logger.warning('Unable to fetch the project list, using the saved one')
+            self.fetched = time.time() - self.max_age + self.min_refresh    # try again after min_refresh
+
+
+    def parse_codes(self, projects):
+        """Add each project's project and job numbers, or why its name is wrong.
+
+        These aren't saved, so changes to project_rules.json apply straight away."""
+        for project in projects.values():
+            codes, error = self.parser.parse_cached(project['name'])
+            project['project_no'], project['job_no'] = codes or (None, None)
+            project['error'] = error
+        return projects
+
+
+    def get_all(self, path, params=None):
+        """Get every page of a v9 list."""
+        items = []
+        page = 1
+        while True:
+            batch = self.client.get(path, self.api_key, dict(params or {}, page=page, per_page=200)) or []
+            items.extend(batch)
+            if len(batch) < 200:
+                return items
+            page += 1
+
+
+    def project(self, pid):
+        """Get a project's details by id, refetching the index once if the id is new."""
+        if self.projects is None:
+            self.load()
+        if pid is not None and pid not in self.projects and time.time() - self.fetched > self.min_refresh:
+            with self.lock:
+                if pid not in self.projects:
+                    self.try_refresh()
+        return self.projects.get(pid)
+
+
+_workspaces = {}
+
+def workspaces(togglapikey, client=None, max_age=24 * 60 * 60):
+    """Get the workspaces for an api key, as 'id (name)' strings, fetched at most once a day per process."""
+    key = user_hash(togglapikey)
+    if key in _workspaces and time.time() - _workspaces[key][0] < max_age:
+        return _workspaces[key][1]
+    r = (client or togglapi.default_client()).get('/api/v9/workspaces', togglapikey)
+    ids = [str(entry['id']) + ' (' + entry['name'] + ')' for entry in r]
+    _workspaces[key] = (time.time(), ids)
+    return ids
@@ -0,0 +1,114 @@
+import json
+import os.path
+import re
+from functools import lru_cache
+
+# The project name formats togglcon understands. Add a project_rules.json next to settings.txt
+# with any of these keys to extend or replace them without changing the code.
+DEFAULT_RULES = {
+    # Project names charged without a project or job number
+    'no_codes': ['NR'],
+    # Rewrites for the project number (the part before '/'), the first rule matching its start is used.
+    # replace is a regex template for the matched part, null keeps the number as it is.
+    'project_rewrites': [
+        {'match': r'P-', 'replace': None},                  # P-xaa-xxx-xxxxx
+        {'match': r'(?s).?(.{0,3})', 'replace': r'PRO\1-'},  # Pxxxxxxx -> PROxxx-xxxx
+    ],
+    # Rewrites for the job number (the part after '/'), a job number matching none of them is invalid
+    'job_rewrites': [
+        {'match': r'J', 'replace': None},                   # Jaa-xxx-xxxxx
+        {'match': r'(?s).(.{0,3})', 'replace': r'WIP\1-'},   # W[7 or 8 x] -> WIPxxx-[4 or 5 x]
+    ],
+    # Accepted project and job numbers after rewriting, matched against their start
+    'project_formats': [r'[A-Z]-\d[A-Z]{3}-\d{3}', r'[A-Z]{3}\d{3}'],
+    'job_formats': [r'[A-Z]{3}-\d{3}', r'[A-Z]{3}\d{3}'],
+}
+
+
+class WrongProjectNameFormatException(Exception):
+    """Exception raised for wrong project name format."""
+    pass
+
+class ProjectParser():
+    """ Converts Toggl project names to (project number, job number) using a table of rules.
+
+    The patterns are compiled once and results (including errors) are memoised, so each
+    project name is only parsed once however many days it appears on.
+    """
+
+    def __init__(self, rules=None, cache_size=1024):
+        rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.no_codes = set(rules['no_codes'])
+        self.project_rewrites = [(re.compile(rule['match']), rule['replace']) for rule in rules['project_rewrites']]
+        self.job_rewrites = [(re.compile(rule['match']), rule['replace']) for rule in rules['job_rewrites']]
+        self.project_formats = [re.compile(pattern) for pattern in rules['project_formats']]
+        self.job_formats = [re.compile(pattern) for pattern in rules['job_formats']]
+        self.parse_cached = lru_cache(maxsize=cache_size)(self.parse_uncached)
+
+
+    def parse(self, project):
+        """Get (project number, job number) for a project name, ('', '') if it has no codes."""
+        codes, error = self.parse_cached(project)
+        if error:
+            raise WrongProjectNameFormatException(error)
+        return codes
+
+
+    def parse_uncached(self, project):
+        """Parse a project name, returning (codes, None) or (None, error message)."""
+        if project in self.no_codes:
+            return ('', ''), None
+        wrong_name = f"The project name \"{project}\" has not followed the correct formatting. Please fix and try again."
+
+        # Extract project number and job number
+        numbers = project.split(' - ')[0].split('/')
+        if len(numbers) < 2:
+            return None, wrong_name
+        project_no = self.rewrite(numbers[0].strip(), self.project_rewrites)
+        job_no = self.rewrite(numbers[1].strip(), self.job_rewrites)
+        if project_no is None or job_no is None:
+            return None, wrong_name
+
+        # Validate project and job number formats
+        if not any(pattern.match(project_no) for pattern in self.project_formats):
+            return None, f"The project name \"{project_no}\" has not followed the correct formatting. Please fix and try again."
+        if not any(pattern.match(job_no) for pattern in self.job_formats):
+            return None, f"The job number \"{job_no}\" in Toggl should be a) [J][2xletter]-[3xdigit], or b) W[3xdigit]"
+        return (project_no, job_no), None
+
+
+    def rewrite(self, number, rewrites):
+        """Apply the first rewrite matching the number, None if none match."""
+        for pattern, replace in rewrites:
+            match = pattern.match(number)
+            if match:
+                return number if replace is None else match.expand(replace) + number[match.end():]
+        return None
+
+
+    def validate_all(self, projects):
+        """Check a whole project list at once, returning {project name: error message} for the invalid ones."""
+        errors = {}
+        for project in projects:
+            error = self.parse_cached(project)[1]
+            if error:
+                errors[project] = error
+        return errors
+
+
+def load_rules(path='project_rules.json'):
+    """Load extra rules from a json file, None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+_default_parser = None
+
+def default_parser():
+    """Get the parser shared by everything in this process, with any rules from project_rules.json."""
+    global _default_parser
+    if _default_parser is None:
+        _default_parser = ProjectParser(load_rules())
+    return _default_parser
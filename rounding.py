@@ -0,0 +1,94 @@
+""" Half hour rounding of timesheet times.
+
+Each (project, tag) total is rounded to the nearest half hour. If the rounded times don't add
+up to the day's total rounded as a whole, the largest times are moved by half an hour each
+until they do. round_day does this for one day in Python, round_days does it for many days at
+once with NumPy (falling back to round_day if NumPy isn't installed, as on Lambda).
+"""
+
+MS_PER_HOUR = 1000 * 60 * 60
+
+
+def round_half_hr(time_ms):
+    """Toggl api returns milliseconds, round to half hours"""
+    time = time_ms / MS_PER_HOUR
+    return round(time * 2) / 2
+
+
+def round_day(project_tag_times):
+    """Round one day's {key: ms} totals, returning ({key: hours}, the day's total hours)."""
+    # First, calculate the sum of actual unrounded hours
+    actual_total_hours_unrounded = sum(time_ms for time_ms in project_tag_times.values()) / MS_PER_HOUR
+
+    # Then, round this sum to the nearest half-hour if necessary
+    actual_total_hours_nearest = round(actual_total_hours_unrounded * 2) / 2
+
+    # Round each project_tag_combination total time to the nearest half-hour
+    project_tag_times_rounded = {key: round_half_hr(time_ms) for key, time_ms in project_tag_times.items()}
+
+    actual_total_hours_rounded = sum(project_tag_times_rounded.values())
+
+    # Assuming the discrepancy must be resolved in half-hour increments
+    if actual_total_hours_rounded != actual_total_hours_nearest:
+        discrepancy = actual_total_hours_nearest - actual_total_hours_rounded
+        discrepancy_sign = discrepancy / abs(discrepancy)
+        adjustments_needed = int(discrepancy * 2)  # Convert to how many half-hours need adjusting
+
+        # Sort entries by rounded time descending, so we start adjustment from the largest
+        sorted_keys = sorted(project_tag_times_rounded, key=project_tag_times_rounded.get, reverse=True)
+        for key in sorted_keys:
+            if adjustments_needed == 0:
+                break  # Stop if no more adjustments are needed
+            # Ensure we don't reduce below 0 hours to maintain minimum billing increments
+            if project_tag_times_rounded[key] >= 0.5:
+                project_tag_times_rounded[key] += 0.5 * discrepancy_sign  # Increase or reduce the time based on the value of discrepancy
+                adjustments_needed -= 1 * discrepancy_sign  # Decrement the needed adjustments the correct way
+
+    return project_tag_times_rounded, actual_total_hours_nearest
+
+
+def reconcile(times_ms, valid):
+    """Round a days x keys NumPy matrix of ms totals, the same way as round_day.
+
+    valid marks the real keys of each day (rows are padded to the longest day). Returns the
+    rounded hours matrix (0 where not valid) and each day's total hours."""
+    import numpy as np
+
+    times_ms = np.where(valid, times_ms, 0).astype(np.int64)
+    rounded = np.where(valid, np.rint(times_ms / MS_PER_HOUR * 2) / 2, 0.0)
+    totals = np.rint(times_ms.sum(axis=1) / MS_PER_HOUR * 2) / 2
+
+    # Half hours to move on each day, and which way
+    adjustments = ((totals - rounded.sum(axis=1)) * 2).astype(np.int64)
+    sign = np.sign(adjustments)
+
+    # Walk each day's keys largest first (ties in key order), adjusting the first
+    # abs(adjustments) keys of at least half an hour
+    order = np.argsort(np.where(valid, -rounded, np.inf), axis=1, kind='stable')
+    eligible = np.take_along_axis(valid & (rounded >= 0.5), order, axis=1)
+    adjust_sorted = eligible & (np.cumsum(eligible, axis=1) <= np.abs(adjustments)[:, None])
+    adjust = np.zeros_like(adjust_sorted)
+    np.put_along_axis(adjust, order, adjust_sorted, axis=1)
+
+    return rounded + np.where(adjust, 0.5 * sign[:, None], 0.0), totals
+
+
+def round_days(days):
+    """Round many days' {key: ms} totals at once, returning a list of ({key: hours}, total hours)."""
+    try:
+        import numpy as np
+    except ImportError:
+        return [round_day(times) for times in days]
+    if not days:
+        return []
+
+    width = max(len(times) for times in days)
+    times_ms = np.zeros((len(days), width), dtype=np.int64)
+    valid = np.zeros((len(days), width), dtype=bool)
+    for i, times in enumerate(days):
+        times_ms[i, :len(times)] = list(times.values())
+        valid[i, :len(times)] = True
+
+    rounded, totals = reconcile(times_ms, valid)
+    rounded, totals = rounded.tolist(), totals.tolist()
+    return [(dict(zip(times, rounded[i])), totals[i]) for i, times in enumerate(days)]
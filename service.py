@@ -0,0 +1,157 @@
+""" Long running HTTP service with the same contract as the Lambda handler.
+
+POST a Lambda event as json to any path and the response is the handler's statusCode,
+headers and body. GET /health answers 200. The api connection pool, day cache and project
+indexes stay warm between requests, at most max_concurrency events run at once, and
+simultaneous single day summaries for the same user and day share one run.
+
+Run with `python service.py --port 8080`. Profiled events ('profile': true) are timed
+together, so their timings include any other request running at the same time.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import togglcon
+
+logger = logging.getLogger('togglcon.service')
+
+MAX_BODY = 1024 * 1024  # bytes
+
+
+class Service():
+    """ Runs Lambda events from HTTP requests on a thread pool. """
+
+    def __init__(self, max_concurrency=16):
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='service')
+        self.inflight = {}  # coalescing key -> task running that event
+        self.coalesced = 0  # requests answered by another request's run
+        togglcon.metadata_indexes = {}  # keep project indexes warm
+
+
+    def coalesce_key(self, event):
+        """Requests with the same key get the same response, None for events that are always run."""
+        if 'jobs' in event or event.get('validate') or not isinstance(event.get('togglapikey'), str):
+            return None     # batches and validation are always run
+        return (event['togglapikey'], str(event.get('workspace_ID')), event.get('date'),
+                bool(event.get('refresh')), bool(event.get('profile')))
+
+
+    async def handle(self, event):
+        """Get the Lambda response for an event, sharing a run already going for the same user and day."""
+        key = self.coalesce_key(event)
+        if key is None:
+            return await self.run(event)
+        task = self.inflight.get(key)
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self.run(event))
+            task.add_done_callback(lambda done: self.inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            log = togglcon.get_audit_log()
+            if log:
+                log.record(event.get('email'), date=event.get('date'))  # the shared run only logs its own request
+        return await asyncio.shield(task)
+
+
+    async def run(self, event):
+        async with self.limit:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, self.call, event)
+
+
+    def call(self, event):
+        try:
+            return togglcon.lambda_handler(event, {})
+        except (KeyError, TypeError, ValueError) as e:
+            return {'statusCode': 400, 'body': f"Invalid event, it needs togglapikey, email, workspace_ID and date as YYYY-MM-DD, or jobs. ({e})"}
+        except Exception as e:
+            logger.exception('Unable to run event')
+            return {'statusCode': 500, 'body': f"An unexpected error occurred: {str(e)}"}
+
+
+    async def connection(self, reader, writer):
+        """Answer the requests on one connection, keeping it open between them."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method == 'GET' and path == '/health':
+                    response = {'statusCode': 200, 'body': 'ok'}
+                elif method != 'POST':
+                    response = {'statusCode': 405, 'body': 'POST a Lambda event as json'}
+                else:
+                    try:
+                        event = json.loads(body)
+                    except ValueError:
+                        event = None
+                    if isinstance(event, dict):
+                        response = await self.handle(event)
+                    else:
+                        response = {'statusCode': 400, 'body': 'The body must be a json object'}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(format_response(response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass    # the client went away, or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    """Read one HTTP/1.1 request, returning (method, path, headers, body) or None at the end of the connection."""
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    method, path, version = line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if version == 'HTTP/1.0':
+        headers.setdefault('connection', 'close')
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError('Request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def format_response(response, keep_alive=True):
+    """Format a Lambda response as an HTTP response."""
+    body = response.get('body', '')
+    body = body.encode() if isinstance(body, str) else body
+    headers = dict({'Content-Type': 'text/plain; charset=utf-8'}, **response.get('headers', {}))
+    headers['Content-Length'] = str(len(body))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    status = HTTPStatus(response['statusCode'])
+    lines = [f'HTTP/1.1 {status.value} {status.phrase}'] + [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+async def serve(host='127.0.0.1', port=8080, max_concurrency=16):
+    service = Service(max_concurrency)
+    server = await asyncio.start_server(service.connection, host, port)
+    logger.warning(f'Serving on http://{host}:{port}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the Lambda handler over HTTP, keeping caches warm.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-concurrency', type=int, default=16, help='most events run at once')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.max_concurrency))
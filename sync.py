@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date as date_type, datetime, timedelta, timezone
+
+import logic
+import metadata as metadata_index
+import togglapi
+
+OVERLAP = 60    # seconds the next sync goes back, so entries saved while syncing aren't missed
+
+
+def default_path():
+    """Keep the synced entries next to settings.txt, or in /tmp on AWS Lambda."""
+    if 'AWS_EXECUTION_ENV' in os.environ:
+        return '/tmp/togglcon_sync.sqlite'
+    return 'sync.sqlite'
+
+
+class IncrementalSync():
+    """ Local copy of a user's time entries, kept up to date with Toggl's modified-since api.
+
+    The first sync loads every entry from a start date. After that only entries created,
+    updated or deleted since the last sync (the watermark) are asked for and patched into the
+    stored set, and only the days they touch, or whose projects were renamed, have their
+    summaries recomputed.
+    """
+
+    def __init__(self, togglapikey, email, workspace_ID, client=None, path=None, parser=None, metadata=None):
+        self.api_key = togglapikey
+        self.user_agent = email
+        self.workspace_id = str(workspace_ID)
+        self.client = client or togglapi.default_client()
+        self.parser = parser
+        self.path = path or default_path()
+        self.metadata = metadata or metadata_index.MetadataIndex(togglapikey, workspace_ID, self.client,
+                                                                 os.path.dirname(self.path), parser)
+        self.user = hashlib.sha256(togglapikey.encode()).hexdigest()[:16]   # same key as the day cache
+        self.lock = threading.Lock()
+        with self.connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS entries (workspace_id TEXT, user TEXT, id INTEGER, day TEXT, start TEXT, '
+                       'entry TEXT, PRIMARY KEY (workspace_id, user, id))')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_day ON entries (workspace_id, user, day)')
+            db.execute('CREATE TABLE IF NOT EXISTS watermarks (workspace_id TEXT, user TEXT, synced REAL, loaded_from TEXT, '
+                       'PRIMARY KEY (workspace_id, user))')
+            db.execute('CREATE TABLE IF NOT EXISTS summaries (workspace_id TEXT, user TEXT, day TEXT, result TEXT, '
+                       'built_from TEXT, PRIMARY KEY (workspace_id, user, day))')
+            if 'built_from' not in [column[1] for column in db.execute('PRAGMA table_info(summaries)')]:
+                db.execute('ALTER TABLE summaries ADD COLUMN built_from TEXT')  # made before summaries were fingerprinted
+
+
+    @contextmanager
+    def connect(self):
+        """Open the database for one transaction."""
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+    def watermark(self):
+        """Get (last sync unix time, first day loaded) or (None, None) before the first sync."""
+        with self.connect() as db:
+            row = db.execute('SELECT synced, loaded_from FROM watermarks WHERE workspace_id = ? AND user = ?',
+                             (self.workspace_id, self.user)).fetchone()
+        if row is None:
+            return None, None
+        return row[0], date_type.fromisoformat(row[1])
+
+
+    def sync(self, since):
+        """Bring the stored entries up to date from since (a date), returning the set of days that changed."""
+        with self.lock:
+            synced, loaded_from = self.watermark()
+            started = time.time()
+            changed = set()
+            if synced is None or since < loaded_from:
+                # Load every entry from since, up to what is already stored
+                end = date_type.today() + timedelta(days=1) if synced is None else loaded_from
+                changed |= self.apply(self.client.get('/api/v9/me/time_entries', self.api_key,
+                                                      {'start_date': since.isoformat(), 'end_date': end.isoformat()}))
+                loaded_from = since
+            if synced is not None:
+                # Then only what changed since the last sync, including deleted entries
+                changed |= self.apply(self.client.get('/api/v9/me/time_entries', self.api_key,
+                                                      {'since': int(synced - OVERLAP)}))
+            with self.connect() as db:
+                db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)',
+                           (self.workspace_id, self.user, started, loaded_from.isoformat()))
+                db.executemany('DELETE FROM summaries WHERE workspace_id = ? AND user = ? AND day = ?',
+                               [(self.workspace_id, self.user, day) for day in changed])
+            return {date_type.fromisoformat(day) for day in changed}
+
+
+    def apply(self, time_entries):
+        """Patch api v9 time entries into the stored set, returning the days (YYYY-MM-DD) touched."""
+        changed = set()
+        if not time_entries:
+            return changed
+        tz = self.user_timezone()
+        with self.connect() as db:
+            for item in time_entries:
+                if str(item.get('workspace_id')) != self.workspace_id:
+                    continue
+                old = db.execute('SELECT day FROM entries WHERE workspace_id = ? AND user = ? AND id = ?',
+                                 (self.workspace_id, self.user, item['id'])).fetchone()
+                if old:
+                    changed.add(old[0])
+                # Deleted and still running entries are left out
+                if item.get('server_deleted_at') or item['duration'] < 0:
+                    db.execute('DELETE FROM entries WHERE workspace_id = ? AND user = ? AND id = ?',
+                               (self.workspace_id, self.user, item['id']))
+                    continue
+                entry = self.report_entry(item, tz)
+                day = entry['start'][:10]
+                changed.add(day)
+                db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                           (self.workspace_id, self.user, item['id'], day, entry['start'], json.dumps(entry)))
+        return changed
+
+
+    def report_entry(self, item, tz):
+        """Convert an api v9 time entry to the shape of a Reports v2 /details entry.
+
+        Only the project id is stored, its name and client are looked up when the day is
+        summarised (see resolve), so a project that isn't in the index yet isn't saved as missing."""
+        start = datetime.fromisoformat(item['start'].replace('Z', '+00:00')).astimezone(tz)
+        return {
+            'id': item['id'],
+            'pid': item.get('project_id'),
+            'project': None,
+            'client': None,
+            'tags': item.get('tags') or [],
+            'description': item.get('description') or '',
+            'dur': item['duration'] * 1000,
+            'start': start.isoformat(),
+        }
+
+
+    def user_timezone(self):
+        """The Toggl user's timezone, which decides what day an entry is on."""
+        name = self.client.get('/api/v9/me', self.api_key).get('timezone')
+        try:
+            from zoneinfo import ZoneInfo
+            return ZoneInfo(name)
+        except Exception:
+            # Unknown zone, or no timezone database (Windows without tzdata)
+            return datetime.now(timezone.utc).astimezone().tzinfo
+
+
+    def entries(self, day):
+        """Stored entries for a day (a date), in start order like the reports api."""
+        with self.connect() as db:
+            rows = db.execute('SELECT entry FROM entries WHERE workspace_id = ? AND user = ? AND day = ? ORDER BY start',
+                              (self.workspace_id, self.user, day.isoformat())).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+    def summary_range(self, since, until):
+        """Sync, then summarise every day from since to until (DD/MM/YY).
+
+        Returns {date: summary_data result} like TimeLogic.summary_range, with each
+        successful result also holding the day's 'total_hours'. Only days that changed
+        since they were last summarised are recomputed."""
+        try:
+            start = datetime.strptime(since, '%d/%m/%y').date()
+            end = datetime.strptime(until, '%d/%m/%y').date()
+        except ValueError:
+            return {"status": "error", "error": "This date does not exist. Please check and try again."}
+        try:
+            self.sync(start)
+        except togglapi.TogglApiException as e:
+            return {"status": "error", "error": str(e)}
+
+        days = {}
+        day = start
+        while day <= end:
+            days[day.strftime('%d/%m/%y')] = self.summary(day)
+            day += timedelta(days=1)
+        return {"status": "success", "days": days}
+
+
+    def clear(self):
+        """Drop the user's stored summaries, so every day is summarised again."""
+        with self.connect() as db:
+            db.execute('DELETE FROM summaries WHERE workspace_id = ? AND user = ?', (self.workspace_id, self.user))
+
+
+    def resolve(self, entries):
+        """Fill in each entry's project name and client from the project index.
+
+        Returns (the entries whose project can't be found, e.g. one created moments ago, and
+        a fingerprint of the project details used, which changes when a project or client is
+        renamed or project_rules.json parses a name differently)."""
+        unresolved, used = [], {}
+        for entry in entries:
+            if entry.get('pid') is None:
+                continue
+            project = self.metadata.project(entry['pid'])
+            if project is None:
+                unresolved.append(entry)
+            else:
+                entry['project'], entry['client'] = project['name'], project['client']
+                used[str(entry['pid'])] = project
+        return unresolved, hashlib.sha256(json.dumps(used, sort_keys=True).encode()).hexdigest()
+
+
+    def summary(self, day):
+        """Get a day's stored summary, recomputing it from the stored entries if they or their projects changed."""
+        entries = self.entries(day)
+        unresolved, built_from = self.resolve(entries)
+        if unresolved:
+            # Not stored, so the day is summarised again once the project index has it
+            return {"status": "error", "error": f"The project of entry \"{unresolved[0]['description']}\" couldn't be found in Toggl. "
+                                                "Please try again in a few minutes."}
+        with self.connect() as db:
+            row = db.execute('SELECT result, built_from FROM summaries WHERE workspace_id = ? AND user = ? AND day = ?',
+                             (self.workspace_id, self.user, day.isoformat())).fetchone()
+        if row and row[1] == built_from:
+            stored = json.loads(row[0])
+        else:
+            timesheet = logic.TimeLogic(self.api_key, self.user_agent, self.workspace_id, self.client,
+                                        parser=self.parser, metadata=self.metadata)
+            result = timesheet.summary_data(day.strftime('%d/%m/%y'), {'data': entries})
+            stored = dict(result)
+            if result['status'] == 'success':
+                stored['data'] = result['data'].to_records()
+                stored['total_hours'] = timesheet.actual_total_hours_nearest
+            with self.connect() as db:
+                db.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?)',
+                           (self.workspace_id, self.user, day.isoformat(), json.dumps(stored), built_from))
+        if stored['status'] == 'success':
+            stored['data'] = logic.TimeTable(stored['data'])
+        return stored
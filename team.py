@@ -0,0 +1,70 @@
+""" Timesheets for a whole team from one team.json.
+
+Each member's range is fetched on a thread, all sharing one rate limited api client and the
+day cache, and summarised in a process pool as soon as it arrives, so fetching and
+summarising overlap and the summarising uses every core.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import logic
+import togglapi
+
+FETCH_WORKERS = 8   # members fetched at once
+
+
+def summarise_member(member, days):
+    """Summarise a member's fetched days ({DD/MM/YY: entries}), in a worker process.
+
+    Returns the timesheet rows of every day and {date: error} for days that failed. Days
+    without entries are left out."""
+    timesheet = logic.TimeLogic(member['api_key'], member['user_agent'], member['workspace_id'])
+    rows, errors = [], {}
+    for date, result in timesheet.summary_days({date: entries for date, entries in days.items() if entries}).items():
+        if result['status'] == 'error':
+            errors[date] = result['error']
+        else:
+            rows.extend(result['data'])
+    return rows, errors
+
+
+def fetch_member(member, since, until, client, cache):
+    timesheet = logic.TimeLogic(member['api_key'], member['user_agent'], member['workspace_id'], client, cache)
+    return timesheet.get_detailed_range(since, until)
+
+
+def run_team(members, since, until, client=None, cache=None, processes=None):
+    """Get every member's timesheets from since to until (DD/MM/YY).
+
+    Returns {user_agent: result} in the order of members, each result either
+    {'status': 'success', 'rows': [...], 'errors': {date: error}} or {'status': 'error', 'error': ...}.
+    processes=0 summarises on this process instead of a pool."""
+    if not members:
+        return {}
+    client = client or togglapi.default_client()
+    results = {member['user_agent']: None for member in members}
+    pool = ProcessPoolExecutor(processes or min(len(members), os.cpu_count() or 1)) if processes != 0 else None
+    try:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as fetch_pool:
+            fetches = {fetch_pool.submit(fetch_member, member, since, until, client, cache): member for member in members}
+            summaries = {}
+            for future in as_completed(fetches):
+                member = fetches[future]
+                try:
+                    days = future.result()
+                except logic.TIMESHEET_EXCEPTIONS as e:
+                    results[member['user_agent']] = {'status': 'error', 'error': str(e)}
+                    continue
+                if pool:
+                    summaries[member['user_agent']] = pool.submit(summarise_member, member, days)
+                else:
+                    rows, errors = summarise_member(member, days)
+                    results[member['user_agent']] = {'status': 'success', 'rows': rows, 'errors': errors}
+        for user_agent, future in summaries.items():
+            rows, errors = future.result()
+            results[user_agent] = {'status': 'success', 'rows': rows, 'errors': errors}
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
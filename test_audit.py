@@ -0,0 +1,78 @@
+""" Tests for the background audit log. """
+
+import json
+import time
+from contextlib import contextmanager
+
+import audit
+
+
+class StandInTable():
+    """ Behaves like a boto3 Table's batch writer, which rejects a batch with repeated keys. """
+
+    def __init__(self):
+        self.items = []
+
+    @contextmanager
+    def batch_writer(self, overwrite_by_pkeys=None):
+        batch = {} if overwrite_by_pkeys else []
+        class Writer():
+            def put_item(self, Item):
+                if overwrite_by_pkeys:
+                    batch[tuple(Item[key] for key in overwrite_by_pkeys)] = Item
+                else:
+                    batch.append(Item)
+        yield Writer()
+        items = list(batch.values()) if overwrite_by_pkeys else batch
+        if len({item['ID-timestamp'] for item in items}) < len(items):
+            raise ValueError('Provided list of item keys contains duplicates')
+        self.items.extend(items)
+
+
+class FailingSink():
+    def write(self, events):
+        raise ConnectionError('DynamoDB is down')
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_events_are_written_in_batches():
+    sink = audit.MemorySink()
+    log = audit.AuditLog(sink, batch_size=10, flush_interval=0.05)
+    for i in range(25):
+        log.record('test@test.com', date=f'2024-08-{i + 1:02d}')
+
+    assert wait_for(lambda: len(sink.events) == 25)
+    assert sink.events[0]['email'] == 'test@test.com' and sink.events[0]['date'] == '2024-08-01'
+    assert sink.events[0]['time'].endswith('+0000')
+
+
+def test_flush_writes_queued_events(tmp_path):
+    path = tmp_path / 'audit.log'
+    log = audit.AuditLog(audit.FileSink(str(path)))
+    log.start = lambda: None    # no background writer, as if frozen between invocations
+    log.record('a@test.com', date='2024-08-21')
+    log.record('b@test.com', date='2024-08-22')
+    log.flush()
+
+    assert [json.loads(line)['email'] for line in path.read_text().splitlines()] == ['a@test.com', 'b@test.com']
+
+
+def test_sink_errors_are_dropped():
+    log = audit.AuditLog(FailingSink(), flush_interval=0.01)
+    log.record('test@test.com', date='2024-08-21')
+    log.flush()
+    assert log.queue.empty()
+
+
+def test_events_in_the_same_second_are_written():
+    sink = audit.DynamoDBSink()
+    sink.table = StandInTable()
+    sink.write([{'time': '2024-08-21T09:00:00+0000', 'email': 'a@test.com', 'date': date} for date in ('2024-08-21', '2024-08-22')]
+               + [{'time': '2024-08-21T09:00:00+0000', 'email': 'b@test.com', 'date': '2024-08-21'}])
+    assert [item['email'] for item in sink.table.items] == ['a@test.com', 'b@test.com']
@@ -0,0 +1,45 @@
+""" Smoke tests for the benchmark generator, stand-in server and harness. """
+
+from datetime import date
+
+import bench
+import logic
+import togglapi
+
+
+def test_generator_is_seeded():
+    day = date(2024, 8, 21)
+    assert bench.PayloadGenerator(seed=3).day(day) == bench.PayloadGenerator(seed=3).day(day)
+    assert bench.PayloadGenerator(seed=3).day(day) != bench.PayloadGenerator(seed=4).day(day)
+
+
+def test_generated_days_summarise():
+    generator = bench.PayloadGenerator(seed=1, entries_per_day=60, projects=30)
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567')
+    result = timesheet.summary_data('21/08/24', {'data': generator.day(date(2024, 8, 21))})
+    assert result['status'] == 'success'
+
+
+def test_stand_in_pages_and_rate_limits():
+    generator = bench.PayloadGenerator(seed=1, entries_per_day=30)
+    with bench.StandInServer(generator, per_page=20, rate_limit_every=2) as server:
+        client = togglapi.TogglClient(server.url, rate=1000, burst=50, backoff=0.01)
+        days = logic.TimeLogic('key', 'test@test.com', '1234567', client).get_detailed_range('20/08/24', '22/08/24')
+    assert [len(entries) for entries in days.values()] == [30, 30, 30]
+    assert server.requests > 5  # 5 pages, plus the 429s
+
+
+def test_run_scale():
+    results = bench.run_scale('small', repeats=1)
+    assert [result['phase'] for result in results] == ['get_detailed_data', 'summary_data', 'create_df', 'summary_range', 'summary_stream', 'lambda_handler']
+
+
+def test_summary_stream_matches_summary_range():
+    generator = bench.PayloadGenerator(seed=2, entries_per_day=25)
+    with bench.StandInServer(generator, per_page=10) as server:
+        client = togglapi.TogglClient(server.url, rate=1000, burst=50)
+        timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client)
+        streamed = dict(timesheet.summary_stream('01/08/24', '05/08/24'))
+        fetched = timesheet.summary_range('01/08/24', '05/08/24')['days']
+    assert list(streamed) == list(fetched)
+    assert [day['data'].to_records() for day in streamed.values()] == [day['data'].to_records() for day in fetched.values()]
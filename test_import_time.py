@@ -0,0 +1,31 @@
+""" Cold start budget: importing the app must stay quick and must not pull in the heavy packages. """
+
+import json
+import subprocess
+import sys
+
+IMPORT_BUDGET = 0.25    # seconds, pandas alone takes about twice this
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'requests', 'boto3']
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import togglcon
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+def measure_import():
+    output = subprocess.run([sys.executable, '-c', MEASURE], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_skips_heavy_modules():
+    assert measure_import()['loaded'] == []
+
+
+def test_import_time_budget():
+    # Best of three so a busy machine doesn't fail the test
+    elapsed = min(measure_import()['elapsed'] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET, f"importing togglcon took {elapsed:.3f}s"
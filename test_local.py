@@ -0,0 +1,61 @@
+""" Tests for the settings files and the Excel workbook export. """
+
+import json
+
+import pytest
+from openpyxl import load_workbook
+
+import local
+
+
+def row(date, hours, description='(Acme) design'):
+    return {'Date': date, 'Branch': '', 'Charge Type': 'LABOUR-ENG', 'Project No': 'PRO123-4567',
+            'Job No': 'WIP123-4567', 'Description': description, 'Hours': hours}
+
+
+def test_export_has_a_sheet_per_week(tmp_path):
+    days = [('23/08/24', [row('23/08/2024', '1.5')]),
+            ('24/08/24', []),
+            ('26/08/24', [row('26/08/2024', '2.0'), row('26/08/2024', '0.5', '(Acme) review')])]
+    path = str(tmp_path / 'timesheets.xlsx')
+    local.export_workbook(path, local.week_sheets(iter(days)))
+
+    workbook = load_workbook(path)
+    assert workbook.sheetnames == ['Week 2024-08-19', 'Week 2024-08-26']
+    first, second = (list(sheet.values) for sheet in workbook.worksheets)
+    assert first == [tuple(local.COLUMNS), ('23/08/2024', None, 'LABOUR-ENG', 'PRO123-4567', 'WIP123-4567', '(Acme) design', 1.5)]
+    assert [values[-1] for values in second[1:]] == [2.0, 0.5]
+
+
+def test_sheet_titles_are_made_safe():
+    assert local.sheet_title('a/b [c]: d?') == 'a-b -c-- d-'
+    assert len(local.sheet_title('x' * 40)) == 31
+
+
+def test_load_team(tmp_path):
+    path = tmp_path / 'team.json'
+    path.write_text(json.dumps({'workspace_id': 1, 'members': [
+        {'user_agent': 'a@test.com', 'api_key': 'alice'},
+        {'user_agent': 'b@test.com', 'api_key': 'bob', 'workspace_id': '2', 'extra': 'ignored'}]}))
+    assert local.load_team(str(path)) == [
+        {'user_agent': 'a@test.com', 'api_key': 'alice', 'workspace_id': '1'},
+        {'user_agent': 'b@test.com', 'api_key': 'bob', 'workspace_id': '2'}]
+
+    path.write_text(json.dumps({'members': [{'user_agent': 'a@test.com', 'api_key': 'alice'}]}))
+    with pytest.raises(ValueError, match='missing workspace_id'):
+        local.load_team(str(path))
+
+    path.write_text(json.dumps({'workspace_id': 1, 'members': [
+        {'user_agent': 'a@test.com', 'api_key': 'alice'}, {'user_agent': 'a@test.com', 'api_key': 'other'}]}))
+    with pytest.raises(ValueError, match='more than once'):
+        local.load_team(str(path))
+
+    path.write_text(json.dumps({'workspace_id': 1, 'members': []}))
+    with pytest.raises(ValueError, match='no members'):
+        local.load_team(str(path))
+
+
+def test_read_settings_only_reads_known_names(tmp_path):
+    path = tmp_path / 'settings.txt'
+    path.write_text('! Example file\n\nuser_agent = a@test.com\napi_key = 12345\nself.x = "1"; import os\n')
+    assert local.read_settings(str(path)) == {'user_agent': 'a@test.com', 'api_key': '12345'}
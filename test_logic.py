@@ -0,0 +1,185 @@
+""" Offline tests for TimeLogic, using canned Toggl entries instead of the api. """
+
+from datetime import date, timedelta
+
+import daycache
+import logic
+
+
+def entry(project, tags, description, minutes, client='Acme', start='2024-08-21T09:00:00+10:00'):
+    return {'project': project, 'client': client, 'tags': tags, 'description': description,
+            'dur': minutes * 60 * 1000, 'start': start}
+
+
+def summarise(entries):
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567')
+    return timesheet, timesheet.summary_data('21/08/24', {'data': entries})
+
+
+def test_summary_data_groups_descriptions():
+    entries = [
+        entry('P1234567/W1234567 - Pump/Design', ['LABOUR-ENG'], 'design', 90),
+        entry('P1234567/W1234567 - Pump/Design', ['LABOUR-ENG'], 'calcs', 60),
+        entry('P1234567/W1234567 - Pump/Design', ['LABOUR-ENG'], 'design', 30),
+        entry('NR', ['NR-ADMIN'], 'email', 40, client='Internal'),
+    ]
+    timesheet, result = summarise(entries)
+
+    assert result['status'] == 'success'
+    assert timesheet.actual_total_hours_nearest == 3.5
+    rows = result['data'].to_records()
+    assert rows == [
+        {'Date': '21/08/24', 'Branch': '', 'Charge Type': 'LABOUR-ENG', 'Project No': 'PRO123-4567',
+         'Job No': 'WIP123-4567', 'Description': '(Acme) design, calcs (1.0hr)', 'Hours': '3.0'},
+        {'Date': '21/08/24', 'Branch': '', 'Charge Type': 'NR-ADMIN', 'Project No': '',
+         'Job No': '', 'Description': 'email', 'Hours': '0.5'},
+    ]
+
+
+def test_summary_data_reconciles_day_total():
+    # Three 20 minute entries round to 0.5hr each (1.5hr) but the day is 1.0hr
+    entries = [
+        entry('P-1ABC-123/JAB-123 - A', ['LABOUR-ENG'], 'a', 20),
+        entry('P-1ABC-124/JAB-124 - B', ['LABOUR-ENG'], 'b', 20),
+        entry('P-1ABC-125/JAB-125 - C', ['LABOUR-ENG'], 'c', 20),
+    ]
+    timesheet, result = summarise(entries)
+
+    assert timesheet.actual_total_hours_nearest == 1.0
+    assert [row['Hours'] for row in result['data']] == ['0.5', '0.5']
+
+
+def test_summary_data_errors():
+    assert summarise([entry('NR', ['LEAVE', 'NR-ADMIN'], 'x', 30)])[1] == {
+        'status': 'error', 'error': 'Multiple valid tags for entry "x". Please fix and try again.'}
+    assert summarise([entry('NR', ['other'], 'x', 30)])[1]['error'].startswith('Missing charge type tag')
+    assert summarise([entry(None, ['LEAVE'], 'x', 30)])[1]['error'].startswith('One of your entries is missing a project')
+    assert summarise([entry('Bad project', ['LEAVE'], 'x', 30)])[1]['error'].startswith('The project name "Bad project"')
+    assert summarise([])[1]['error'] == 'There is no timesheet data entered for this day.'
+
+
+class CountingClient():
+    """ Stand-in for togglapi.TogglClient serving one page of entries. """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.calls = 0
+
+    def get(self, path, api_key, params=None):
+        self.calls += 1
+        return {'total_count': len(self.entries), 'per_page': 50, 'data': self.entries}
+
+
+def test_closed_days_come_from_cache(tmp_path):
+    client = CountingClient([entry('NR', ['LEAVE'], 'x', 30, start='2024-08-21T09:00:00+10:00')])
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client, cache)
+
+    first = timesheet.get_detailed_range('20/08/24', '22/08/24')
+    assert timesheet.get_detailed_range('20/08/24', '22/08/24') == first
+    assert timesheet.get_detailed_data('21/08/24')['data'] == first['21/08/24']
+    assert timesheet.get_detailed_data('21/8/24')['data'] == first['21/08/24']   # typed without zero padding
+    assert client.calls == 1
+
+    # Another api key doesn't share the cached days, and bypass always refetches
+    logic.TimeLogic('other', 'test@test.com', '1234567', client, cache).get_detailed_data('21/08/24')
+    cache.bypass = True
+    timesheet.get_detailed_data('21/08/24')
+    assert client.calls == 3
+
+
+def test_time_table():
+    table = logic.TimeLogic('key', 'test@test.com', '1234567').create_df({'date': '21/08/24', 'data': [
+        {'charge_type': 'LEAVE', 'project_short': 'PRO123-4567', 'W': 'WIP123-4567', 'output_desc': 'x' * 70, 'time_rounded': 1.0},
+        {'charge_type': 'LEAVE', 'project_short': 'PRO999-9999', 'W': 'WIP999-9999', 'output_desc': 'y', 'time_rounded': 0.5},
+    ]})
+
+    assert [row['Project No'] for row in table] == ['PRO999-9999', 'PRO123-4567']
+    assert list(table.to_df().columns) == logic.TimeTable.columns
+    lines = table.to_string(max_width=60).splitlines()
+    assert lines[0].split() == ['Date', 'Branch', 'Charge', 'Type', 'Project', 'No', 'Job', 'No', 'Description', 'Hours']
+    assert lines[2].split()[-2:] == ['x' * 57 + '...', '1.0']
+
+
+def test_entry_store_shares_repeated_values():
+    entries = [entry('P1234567/W1234567 - Pump', ['LABOUR-ENG'], ''.join(['des', 'ign']), 30) for _ in range(2)]
+    store = logic.EntryStore(entries)
+    assert store.descriptions[0] is store.descriptions[1]
+    assert store.tags[0] is store.tags[1]
+    assert list(store.durations) == [1800000, 1800000]
+    assert store.to_entries() == [dict(e, pid=None) for e in entries]
+    assert store == [dict(e, pid=None) for e in entries]
+
+
+def test_validate_range_finds_every_problem():
+    client = CountingClient([
+        entry('P1234567/W1234567 - Pump', ['LABOUR-ENG'], 'fine', 60, start='2024-08-20T09:00:00+10:00'),
+        entry('Pump redesign', ['LABOUR-ENG', 'LEAVE'], 'both', 30, start='2024-08-20T10:00:00+10:00'),
+        entry(None, [], 'nothing', 90, start='2024-08-21T09:00:00+10:00'),
+    ])
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client)
+    result = timesheet.validate_range('20/08/24', '22/08/24')
+
+    assert client.calls == 1
+    assert list(result['problems']) == ['20/08/24', '21/08/24']
+    both, = result['problems']['20/08/24']
+    assert both['hours'] == 0.5
+    assert [error.split(' ')[0] for error in both['errors']] == ['Multiple', 'The']
+    nothing, = result['problems']['21/08/24']
+    assert [error.split(' ')[0] for error in nothing['errors']] == ['Missing', 'One']
+
+
+def test_days_that_fail_are_fetched_again(tmp_path):
+    client = CountingClient([entry('NR', [], 'x', 30, start='2024-08-21T09:00:00+10:00')])
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client, cache)
+    assert timesheet.summary_data('21/08/24')['error'].startswith('Missing charge type tag')
+
+    # The user fixes the entry
+    client.entries = [entry('NR', ['LEAVE'], 'x', 30, start='2024-08-21T09:00:00+10:00')]
+    assert timesheet.summary_data('21/08/24')['status'] == 'success'
+    assert timesheet.summary_data('21/08/24')['status'] == 'success'
+    assert client.calls == 2
+
+
+def test_only_days_before_this_week_are_closed(tmp_path):
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    assert cache.ttl(monday) == cache.ttl(today - timedelta(days=1)) == cache.recent_ttl
+    assert cache.ttl(monday - timedelta(days=2)) == cache.closed_ttl
+
+
+def test_validate_range_skips_the_cache(tmp_path):
+    client = CountingClient([entry('NR', [], 'x', 30, start='2024-08-21T09:00:00+10:00')])
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client, cache)
+    timesheet.get_detailed_range('20/08/24', '22/08/24')
+
+    client.entries = [entry('NR', ['LEAVE'], 'x', 30, start='2024-08-21T09:00:00+10:00')]
+    assert timesheet.validate_range('20/08/24', '22/08/24')['problems'] == {}
+    assert timesheet.get_detailed_data('21/08/24')['data'] == [dict(client.entries[0], pid=None)]
+    assert client.calls == 2
+
+
+def test_stream_reads_cached_days(tmp_path):
+    class PagedClient(CountingClient):
+        def get(self, path, api_key, params=None):
+            self.calls += 1
+            self.spans.append((params['since'], params['until']))
+            entries = [e for e in self.entries if params['since'] <= e['start'][:10] <= params['until']]
+            return {'total_count': len(entries), 'per_page': 50, 'data': entries}
+
+    client = PagedClient([entry('NR', ['LEAVE'], 'x', 30, start=f'2024-08-{day:02d}T09:00:00+10:00') for day in (5, 12, 20)])
+    client.spans = []
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', client, cache)
+    timesheet.get_detailed_range('01/08/24', '10/08/24')
+
+    days = dict(timesheet.summary_stream('01/08/24', '20/08/24'))
+    assert client.spans[-1] == ('2024-08-11', '2024-08-20')     # only the days that weren't cached
+    assert [days[date]['data'].to_records()[0]['Hours'] for date in ('05/08/24', '12/08/24', '20/08/24')] == ['0.5'] * 3
+
+    calls = client.calls
+    assert dict(timesheet.summary_stream('01/08/24', '20/08/24')).keys() == days.keys()
+    assert client.calls == calls
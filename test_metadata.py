@@ -0,0 +1,57 @@
+""" Tests for the project and client index, with a stand-in api v9 client. """
+
+import logic
+import metadata
+import togglapi
+
+
+class StandInClient():
+    """ Serves a workspace's projects and clients, counting the requests. """
+
+    def __init__(self):
+        self.projects = [{'id': 10, 'name': 'P1234567/W1234567 - Pump', 'client_id': 20},
+                         {'id': 11, 'name': 'NR', 'client_id': None},
+                         {'id': 12, 'name': 'Pump redesign', 'client_id': 20}]
+        self.requests = []
+        self.down = False
+
+    def get(self, path, api_key, params=None):
+        self.requests.append(path)
+        if self.down:
+            raise togglapi.TogglApiException('Toggl is unavailable (HTTP 503). Please try again later.')
+        if path.endswith('/clients'):
+            return [{'id': 20, 'name': 'Acme'}]
+        return self.projects
+
+
+def test_index_is_saved_and_reloaded(tmp_path):
+    client = StandInClient()
+    index = metadata.MetadataIndex('key', 1, client, str(tmp_path)).load()
+    assert index.project(10) == {'name': 'P1234567/W1234567 - Pump', 'client': 'Acme',
+                                 'project_no': 'PRO123-4567', 'job_no': 'WIP123-4567', 'error': None}
+    assert index.project(11)['project_no'] == ''
+    assert index.project(12)['error'].startswith('The project name "Pump redesign"')
+
+    again = metadata.MetadataIndex('key', 1, client, str(tmp_path)).load()
+    assert again.project(10)['client'] == 'Acme'
+    assert len(client.requests) == 2    # loaded from the file the second time
+
+
+def test_unknown_project_refetches_once(tmp_path):
+    client = StandInClient()
+    index = metadata.MetadataIndex('key', 1, client, str(tmp_path), min_refresh=0).load()
+    client.projects.append({'id': 13, 'name': 'P7654321/W7654321 - Valve', 'client_id': None})
+    assert index.project(13)['project_no'] == 'PRO765-4321'
+
+    client.down = True
+    assert index.project(14) is None    # api failures fall back to parsing the name
+
+
+def test_summary_uses_index(tmp_path):
+    client = StandInClient()
+    index = metadata.MetadataIndex('key', 1, client, str(tmp_path))
+    entries = [{'pid': 10, 'project': 'P1234567/W1234567 - Pump', 'client': 'Old name', 'tags': ['LABOUR-ENG'],
+                'description': 'design', 'dur': 3600000, 'start': '2024-08-21T09:00:00+10:00'}]
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1', client, metadata=index)
+    result = timesheet.summary_data('21/08/24', {'data': entries})
+    assert result['data'].to_records()[0]['Description'] == '(Acme) design'
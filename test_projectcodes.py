@@ -0,0 +1,40 @@
+""" Tests for the project name rules. """
+
+import pytest
+
+import projectcodes
+
+
+def test_default_rules():
+    parser = projectcodes.ProjectParser()
+    assert parser.parse('P-1ABC-123-45678/JAB-123-45678 - Pump/Design') == ('P-1ABC-123-45678', 'JAB-123-45678')
+    assert parser.parse('P1234567/W12345678 - Pump/Design') == ('PRO123-4567', 'WIP123-45678')
+    assert parser.parse('NR') == ('', '')
+    with pytest.raises(projectcodes.WrongProjectNameFormatException, match='"Pump" has not followed'):
+        parser.parse('Pump')
+    with pytest.raises(projectcodes.WrongProjectNameFormatException, match='job number "WIP12-"'):
+        parser.parse('P1234567/W12 - Pump')
+
+
+def test_extra_rules():
+    parser = projectcodes.ProjectParser({
+        'no_codes': ['NR', 'TRAINING'],
+        'project_rewrites': [{'match': r'Q(\d{3})', 'replace': r'QUO\1-'}] + projectcodes.DEFAULT_RULES['project_rewrites'],
+    })
+    assert parser.parse('TRAINING') == ('', '')
+    assert parser.parse('Q1234567/W1234567 - Quote') == ('QUO123-4567', 'WIP123-4567')
+
+
+def test_parses_each_name_once():
+    parser = projectcodes.ProjectParser()
+    for _ in range(3):
+        parser.parse('P1234567/W1234567')
+        with pytest.raises(projectcodes.WrongProjectNameFormatException):
+            parser.parse('Pump')
+    assert parser.parse_cached.cache_info().misses == 2
+
+
+def test_validate_all():
+    parser = projectcodes.ProjectParser()
+    errors = parser.validate_all(['NR', 'P1234567/W1234567 - Pump', 'Pump', 'P-1/J1'])
+    assert list(errors) == ['Pump', 'P-1/J1']
@@ -0,0 +1,70 @@
+""" Equivalence tests: the batched NumPy reconciliation must match the one day Python version exactly. """
+
+import random
+import sys
+
+import numpy as np
+import pytest
+
+import rounding
+
+HALF_HOUR = 30 * 60 * 1000
+
+
+def random_day(rng):
+    """A day's {key: ms} totals, biased towards the cases that need reconciling."""
+    keys = rng.randint(1, 12)
+    style = rng.choice(['any', 'small', 'quarters', 'near_half', 'ties'])
+    times = {}
+    for key in range(keys):
+        if style == 'small':
+            ms = rng.randint(1, HALF_HOUR)      # lots of entries rounding up or down to 0.5hr
+        elif style == 'quarters':
+            ms = rng.randint(0, 20) * HALF_HOUR // 2   # exactly on .25hr boundaries, where rounding ties
+        elif style == 'near_half':
+            ms = rng.randint(0, 16) * HALF_HOUR + rng.choice([-1, 0, 1]) * rng.randint(0, 60000) + HALF_HOUR // 2
+        elif style == 'ties':
+            ms = rng.choice([HALF_HOUR // 2, HALF_HOUR, 3 * HALF_HOUR // 2])
+        else:
+            ms = rng.randint(0, 10 * 60 * 60 * 1000)
+        times[('project %d' % key, 'LABOUR-ENG')] = max(ms, 0)
+    return times
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_round_days_matches_round_day(seed):
+    rng = random.Random(seed)
+    days = [random_day(rng) for _ in range(200)]
+    assert rounding.round_days(days) == [rounding.round_day(times) for times in days]
+
+
+def test_reconcile_matrix_with_padding():
+    rng = random.Random(99)
+    days = [random_day(rng) for _ in range(500)]
+    width = max(len(times) for times in days)
+    times_ms = np.full((len(days), width), 123456789, dtype=np.int64)  # padding must be ignored
+    valid = np.zeros((len(days), width), dtype=bool)
+    for i, times in enumerate(days):
+        times_ms[i, :len(times)] = list(times.values())
+        valid[i, :len(times)] = True
+
+    rounded, totals = rounding.reconcile(times_ms, valid)
+    for i, times in enumerate(days):
+        expected, expected_total = rounding.round_day(times)
+        assert rounded[i, :len(times)].tolist() == list(expected.values())
+        assert not rounded[i, len(times):].any()
+        assert totals[i] == expected_total
+
+
+def test_known_days():
+    # Three 20 minute entries: 1.5hr rounded, 1.0hr in total, so the first is taken down
+    assert rounding.round_days([{'a': 1200000, 'b': 1200000, 'c': 1200000}]) == [({'a': 0.0, 'b': 0.5, 'c': 0.5}, 1.0)]
+    # Two 40 minute entries: 1.0hr rounded, 1.5hr in total, so the first is taken up
+    assert rounding.round_days([{'a': 2400000, 'b': 2400000}]) == [({'a': 1.0, 'b': 0.5}, 1.5)]
+    assert rounding.round_days([]) == []
+
+
+def test_round_days_without_numpy(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'numpy', None)
+    days = [{'a': 1200000, 'b': 1200000, 'c': 1200000}]
+    assert rounding.round_days(days) == [rounding.round_day(days[0])]
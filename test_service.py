@@ -0,0 +1,92 @@
+""" Tests for the HTTP service, with a stand-in api client. """
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import service
+import togglapi
+import togglcon
+
+
+class SlowClient():
+    """ Serves one entry a day for 'alice' slowly, counting the requests. """
+
+    def __init__(self):
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, api_key, params=None):
+        with self.lock:
+            self.calls += 1
+        time.sleep(0.2)
+        if api_key != 'alice':
+            raise togglapi.TogglApiException('Toggl refused the request (HTTP 403). Please check your API key and workspace ID.')
+        entry = {'project': 'NR', 'client': 'Acme', 'tags': ['LEAVE'], 'description': 'work',
+                 'dur': 3600000, 'start': params['since'] + 'T09:00:00+10:00'}
+        return {'total_count': 1, 'per_page': 50, 'data': [entry]}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = SlowClient()
+    monkeypatch.setattr(togglapi, '_default_client', client)
+    monkeypatch.setattr(togglcon, 'metadata_indexes', None)
+    return client
+
+
+async def post(port, body, path='/'):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = body.encode()
+    writer.write(f'POST {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body.decode()
+
+
+def run_with_service(requests):
+    async def main():
+        server = service.Service(max_concurrency=4)
+        # Project indexes are off here, the stand-in doesn't serve projects
+        togglcon.metadata_indexes = None
+        listener = await asyncio.start_server(server.connection, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            responses = await asyncio.gather(*(post(port, body) for body in requests))
+        return server, responses
+    return asyncio.run(main())
+
+
+def event(key='alice', date='2024-08-21'):
+    return json.dumps({'togglapikey': key, 'email': 'a@test.com', 'workspace_ID': '1', 'date': date, 'refresh': True})
+
+
+def test_same_user_and_day_are_fetched_once(client):
+    server, responses = run_with_service([event()] * 3 + [event(date='2024-08-22')])
+    assert [status for status, body in responses] == [200] * 4
+    assert json.loads(responses[0][1])['Data'][0]['Hours'] == '1.0'
+    assert client.calls == 2
+    assert server.coalesced == 2
+
+
+def test_errors_keep_the_lambda_contract(client):
+    server, responses = run_with_service([event(key='carol'), '{"date": "2024-08-21"}', 'not json'])
+    assert responses[0] == (400, 'Toggl refused the request (HTTP 403). Please check your API key and workspace ID.')
+    assert responses[1][0] == 400 and responses[1][1].startswith('Invalid event')
+    assert responses[2] == (400, 'The body must be a json object')
+
+
+def test_validate_requests_are_not_shared(client):
+    week = json.dumps({'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'validate': True,
+                       'since': '2024-08-19', 'until': '2024-08-23', 'refresh': True})
+    day = json.dumps({'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'validate': True,
+                      'date': '2024-08-21', 'refresh': True})
+    server, responses = run_with_service([week, day, event()])
+    assert [status for status, body in responses] == [200] * 3
+    assert server.coalesced == 0
+    assert client.calls == 3
+    assert 'Data' in json.loads(responses[2][1])
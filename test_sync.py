@@ -0,0 +1,107 @@
+""" Tests for incremental sync, with a stand-in for the api v9 time entries. """
+
+from datetime import date
+
+import pytest
+
+import sync
+
+
+class StandInClient():
+    """ Keeps api v9 time entries, answering modified-since requests from their 'at' time. """
+
+    def __init__(self):
+        self.time_entries = {}
+        self.clock = 1000
+        self.requests = []
+        self.projects = [{'id': 10, 'name': 'P1234567/W1234567 - Pump', 'client_id': 20}]
+
+    def save(self, id, start, minutes, description='work', deleted=False, project_id=10):
+        self.clock += 100
+        self.time_entries[id] = {'id': id, 'workspace_id': 1, 'project_id': project_id, 'tags': ['LABOUR-ENG'],
+                                 'description': description, 'start': start, 'duration': minutes * 60,
+                                 'at': self.clock, 'server_deleted_at': self.clock if deleted else None}
+
+    def get(self, path, api_key, params=None):
+        self.requests.append((path, params))
+        if path == '/api/v9/me':
+            return {'timezone': 'Australia/Brisbane'}
+        if path.endswith('/projects'):
+            return self.projects
+        if path.endswith('/clients'):
+            return [{'id': 20, 'name': 'Acme'}]
+        if 'since' in params:
+            return [e for e in self.time_entries.values() if e['at'] >= params['since']]
+        return [e for e in self.time_entries.values() if not e['server_deleted_at']]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = StandInClient()
+    monkeypatch.setattr(sync.time, 'time', lambda: client.clock + sync.OVERLAP + 1)
+    return client
+
+
+def hours(result, day):
+    return [row['Hours'] for row in result['days'][day]['data']]
+
+
+def test_only_changes_are_fetched(client, tmp_path):
+    client.save(1, '2024-08-20T23:00:00Z', 60)  # 21/08 in Brisbane
+    client.save(2, '2024-08-21T23:00:00Z', 90)
+    week = sync.IncrementalSync('key', 'test@test.com', 1, client, str(tmp_path / 'sync.sqlite'))
+
+    result = week.summary_range('21/08/24', '23/08/24')
+    assert hours(result, '21/08/24') == ['1.0']
+    assert hours(result, '22/08/24') == ['1.5']
+    assert result['days']['23/08/24']['status'] == 'error'
+    assert result['days']['21/08/24']['total_hours'] == 1.0
+
+    # Entry 1 is edited, entry 2 deleted and entry 3 added
+    client.save(1, '2024-08-20T23:00:00Z', 120)
+    client.save(2, '2024-08-21T23:00:00Z', 90, deleted=True)
+    client.save(3, '2024-08-22T23:00:00Z', 30)
+    assert week.sync(date(2024, 8, 21)) == {date(2024, 8, 21), date(2024, 8, 22), date(2024, 8, 23)}
+    assert client.requests[-2][1] == {'since': 1200 + 1}  # first sync's time (clock + OVERLAP + 1), less OVERLAP
+
+    result = week.summary_range('21/08/24', '23/08/24')
+    assert hours(result, '21/08/24') == ['2.0']
+    assert result['days']['22/08/24']['status'] == 'error'
+    assert hours(result, '23/08/24') == ['0.5']
+
+
+def test_unchanged_days_are_not_recomputed(client, tmp_path, monkeypatch):
+    client.save(1, '2024-08-20T23:00:00Z', 60)
+    week = sync.IncrementalSync('key', 'test@test.com', 1, client, str(tmp_path / 'sync.sqlite'))
+    week.summary_range('21/08/24', '21/08/24')
+
+    monkeypatch.setattr(sync.logic, 'TimeLogic', None)  # any recompute would fail
+    assert hours(week.summary_range('21/08/24', '21/08/24'), '21/08/24') == ['1.0']
+
+
+def test_new_projects_are_not_saved_as_missing(client, tmp_path):
+    week = sync.IncrementalSync('key', 'test@test.com', 1, client, str(tmp_path / 'sync.sqlite'))
+    week.metadata.refresh()
+
+    # An entry on a project made after the index was fetched
+    client.projects.append({'id': 11, 'name': 'P7654321/W7654321 - Valve', 'client_id': 20})
+    client.save(1, '2024-08-20T23:00:00Z', 60, project_id=11)
+    result = week.summary_range('21/08/24', '21/08/24')
+    assert result['days']['21/08/24']['error'].startswith('The project of entry "work" couldn\'t be found')
+
+    week.metadata.min_refresh = 0   # the index may be refetched again
+    assert hours(week.summary_range('21/08/24', '21/08/24'), '21/08/24') == ['1.0']
+
+
+def test_renamed_projects_are_summarised_again(client, tmp_path):
+    client.projects[0]['name'] = 'bad name'
+    client.save(1, '2024-08-20T23:00:00Z', 60)
+    week = sync.IncrementalSync('key', 'test@test.com', 1, client, str(tmp_path / 'sync.sqlite'))
+    week.metadata.refresh()
+    result = week.summary_range('21/08/24', '21/08/24')
+    assert result['days']['21/08/24']['error'].startswith('The project name "bad name" has not followed')
+
+    # Fixed in Toggl without touching the entry
+    client.projects[0]['name'] = 'P1234567/W1234567 - Pump'
+    week.metadata.refresh()
+    assert hours(week.summary_range('21/08/24', '21/08/24'), '21/08/24') == ['1.0']
@@ -0,0 +1,49 @@
+""" Tests for the team export, with a stand-in api client. """
+
+import pytest
+
+import team
+import togglapi
+
+
+class StandInClient():
+    """ Serves one page of entries per api key, unknown keys are refused. """
+
+    def __init__(self, entries_by_key):
+        self.entries_by_key = entries_by_key
+
+    def get(self, path, api_key, params=None):
+        if api_key not in self.entries_by_key:
+            raise togglapi.TogglApiException('Toggl refused the request (HTTP 403). Please check your API key and workspace ID.')
+        entries = [e for e in self.entries_by_key[api_key] if params['since'] <= e['start'][:10] <= params['until']]
+        return {'total_count': len(entries), 'per_page': 50, 'data': entries}
+
+
+def entry(start, minutes=60, tags=('LEAVE',)):
+    return {'project': 'NR', 'client': 'Acme', 'tags': list(tags), 'description': 'work',
+            'dur': minutes * 60 * 1000, 'start': start + 'T09:00:00+10:00'}
+
+
+def member(name):
+    return {'user_agent': f'{name}@test.com', 'api_key': name, 'workspace_id': '1'}
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_run_team(processes):
+    client = StandInClient({
+        'alice': [entry('2024-08-20'), entry('2024-08-21', 90)],
+        'bob': [entry('2024-08-20', tags=())],
+    })
+    members = [member('alice'), member('bob'), member('carol')]
+    results = team.run_team(members, '20/08/24', '22/08/24', client, processes=processes)
+
+    assert list(results) == ['alice@test.com', 'bob@test.com', 'carol@test.com']
+    alice, bob, carol = results.values()
+    assert [row['Hours'] for row in alice['rows']] == ['1.0', '1.5']
+    assert alice['errors'] == {}
+    assert bob['errors']['20/08/24'].startswith('Missing charge type tag')
+    assert carol['status'] == 'error'
+
+
+def test_run_team_without_members():
+    assert team.run_team([], '20/08/24', '22/08/24', StandInClient({})) == {}
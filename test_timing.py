@@ -0,0 +1,24 @@
+""" Tests for phase timing. """
+
+import timing
+
+
+def test_off_by_default():
+    assert timing.phase('summary_data') is timing.phase('create_df')   # the shared no-op
+    assert timing.stop() is None
+
+
+def test_records_phases_and_calls_hooks(monkeypatch):
+    seen = []
+    monkeypatch.setattr(timing, 'hooks', [lambda name, seconds: 1 / 0, lambda name, seconds: seen.append(name)])
+    timings = timing.start()
+    for name in ['get_detailed_data', 'get_detailed_data', 'summary_data']:
+        with timing.phase(name):
+            pass
+    assert timing.stop() is timings
+
+    assert list(timings.totals()) == ['get_detailed_data', 'summary_data']
+    assert timings.totals()['get_detailed_data'][1] == 2
+    assert timings.server_timing().startswith('get_detailed_data;dur=')
+    assert '"2 calls"' in timings.server_timing()
+    assert seen == ['get_detailed_data', 'get_detailed_data', 'summary_data']   # after a failing hook
@@ -0,0 +1,73 @@
+""" Tests for TogglClient against a local stand-in for the Toggl api. """
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import logic
+import togglapi
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """ Answers each request with the next canned (status, headers, body) response. """
+    responses = []
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        status, headers, body = self.responses.pop(0)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StandIn.responses, StandIn.paths = [], []
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield StandIn, f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+def test_retries_after_rate_limit(server):
+    handler, url = server
+    handler.responses += [(429, {'Retry-After': '0'}, {}), (200, {}, [{'id': 1, 'name': 'Work'}])]
+    client = togglapi.TogglClient(url, rate=100, backoff=0.01)
+
+    assert client.get('/api/v9/workspaces', 'key') == [{'id': 1, 'name': 'Work'}]
+    assert len(handler.paths) == 2
+
+
+def test_gives_up_with_clear_error(server):
+    handler, url = server
+    handler.responses += [(429, {'Retry-After': '0'}, {})] * 2 + [(403, {}, {})]
+    client = togglapi.TogglClient(url, rate=100, retries=1, backoff=0.01)
+
+    with pytest.raises(togglapi.TogglApiException, match='busy'):
+        client.get('/api/v9/workspaces', 'key')
+    with pytest.raises(togglapi.TogglApiException, match='API key'):
+        client.get('/api/v9/workspaces', 'key')
+
+
+def test_detailed_range_reads_every_page(server):
+    handler, url = server
+    entry = {'project': 'NR', 'client': '', 'tags': ['LEAVE'], 'description': 'x', 'dur': 1800000}
+    handler.responses += [
+        (200, {}, {'total_count': 3, 'per_page': 2, 'data': [dict(entry, start='2024-08-21T09:00:00+10:00')] * 2}),
+        (200, {}, {'total_count': 3, 'per_page': 2, 'data': [dict(entry, start='2024-08-22T09:00:00+10:00')]}),
+    ]
+    timesheet = logic.TimeLogic('key', 'test@test.com', '1234567', togglapi.TogglClient(url, rate=100))
+
+    days = timesheet.get_detailed_range('21/08/24', '23/08/24')
+    assert {date: len(entries) for date, entries in days.items()} == {'21/08/24': 2, '22/08/24': 1, '23/08/24': 0}
+    assert sorted('page=2' in path for path in handler.paths) == [False, True]
@@ -0,0 +1,176 @@
+""" Offline tests for the Lambda handlers, with a stand-in api client. """
+
+import json
+from datetime import datetime
+
+import pytest
+
+import audit
+import daycache
+import togglapi
+import togglcon
+
+
+class StandInClient():
+    """ Serves one page of entries per api key, unknown keys are refused. """
+
+    def __init__(self, entries_by_key):
+        self.entries_by_key = entries_by_key
+
+    def get(self, path, api_key, params=None):
+        if api_key not in self.entries_by_key:
+            raise togglapi.TogglApiException('Toggl refused the request (HTTP 403). Please check your API key and workspace ID.')
+        entries = [e for e in self.entries_by_key[api_key] if params['since'] <= e['start'][:10] <= params['until']]
+        return {'total_count': len(entries), 'per_page': 50, 'data': entries}
+
+
+def entry(start, minutes=60, project='NR', tags=('LEAVE',)):
+    return {'project': project, 'client': 'Acme', 'tags': list(tags), 'description': 'work',
+            'dur': minutes * 60 * 1000, 'start': start + 'T09:00:00+10:00'}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = StandInClient({
+        'alice': [entry('2024-08-20'), entry('2024-08-21', 90)],
+        'bob': [entry('2024-08-21', tags=())],
+    })
+    monkeypatch.setattr(togglapi, '_default_client', client)
+    return client
+
+
+def test_batch_handler(client):
+    jobs = [
+        {'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'since': '2024-08-20', 'until': '2024-08-22'},
+        {'togglapikey': 'bob', 'email': 'b@test.com', 'workspace_ID': '1', 'date': '2024-08-21'},
+        {'togglapikey': 'carol', 'email': 'c@test.com', 'workspace_ID': '1', 'date': '2024-08-21'},
+        {'togglapikey': 'dave', 'email': 'd@test.com', 'workspace_ID': '1'},
+        'oops',
+    ]
+    response = togglcon.lambda_handler({'jobs': jobs, 'refresh': True}, {})
+
+    assert response['statusCode'] == 200
+    alice, bob, carol, dave, oops = json.loads(response['body'])['Results']
+    assert [day['status'] for day in alice['days'].values()] == ['success', 'success', 'error']
+    assert alice['days']['2024-08-21']['Data'][0]['Hours'] == '1.5'
+    assert bob['days']['2024-08-21']['error'].startswith('Missing charge type tag')
+    assert carol == {'status': 'error', 'error': 'Toggl refused the request (HTTP 403). Please check your API key and workspace ID.'}
+    assert dave['error'].startswith('Invalid job')
+    assert oops['error'].startswith('Invalid job')
+
+
+def test_batch_handler_needs_jobs():
+    assert togglcon.lambda_handler({'jobs': []}, {})['statusCode'] == 400
+
+
+@pytest.mark.parametrize('max_workers', [0, -1, 'many', None])
+def test_batch_handler_checks_max_workers(max_workers):
+    jobs = [{'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'date': '2024-08-21'}]
+    assert togglcon.lambda_handler({'jobs': jobs, 'max_workers': max_workers}, {})['statusCode'] == 400
+
+
+def test_lambda_handler(client):
+    event = {'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'date': '2024-08-21', 'refresh': True}
+    response = togglcon.lambda_handler(event, {})
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'Data': [{'Date': '21/08/24', 'Branch': '', 'Charge Type': 'LEAVE',
+        'Project No': '', 'Job No': '', 'Description': 'work', 'Hours': '1.5'}]}
+
+
+def test_lambda_handler_error(client):
+    event = {'togglapikey': 'bob', 'email': 'b@test.com', 'workspace_ID': '1', 'date': '2024-08-21', 'refresh': True}
+    response = togglcon.lambda_handler(event, {})
+
+    assert response == {'statusCode': 400, 'body': 'Missing charge type tag for entry "work". Please fix and try again.'}
+
+
+def test_dumps_without_orjson(monkeypatch):
+    body = {'Data': [{'Description': '(Café) design', 'Hours': '1.5'}]}
+    fast = togglcon.dumps(body)
+    monkeypatch.setattr(togglcon, 'orjson', None)
+    assert togglcon.dumps(body) == fast
+
+
+def test_lambda_handler_profile(client):
+    event = {'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1', 'date': '2024-08-21',
+             'refresh': True, 'profile': True}
+    response = togglcon.lambda_handler(event, {})
+
+    phases = [item.split(';')[0] for item in response['headers']['Server-Timing'].split(', ')]
+    assert phases == ['get_detailed_data', 'summary_data', 'round_times', 'create_df', 'serialise']
+    assert 'Server-Timing' not in togglcon.lambda_handler(dict(event, profile=False), {})['headers']
+
+
+def test_lambda_handler_flushes_audit_without_thread(client, monkeypatch):
+    log = audit.AuditLog(audit.MemorySink(), background=False)
+    monkeypatch.setattr(togglcon, 'audit_log', log)
+    togglcon.lambda_handler({'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1',
+                             'date': '2024-08-21', 'refresh': True}, {})
+    assert log.thread is None
+    assert [e['email'] for e in log.sink.events] == ['a@test.com']  # written before returning
+
+
+def test_lambda_handler_audit(client, monkeypatch):
+    log = audit.AuditLog(audit.MemorySink())
+    log.start = lambda: None
+    monkeypatch.setattr(togglcon, 'audit_log', log)
+    togglcon.lambda_handler({'togglapikey': 'alice', 'email': 'a@test.com', 'workspace_ID': '1',
+                             'date': '2024-08-21', 'refresh': True}, {})
+    log.flush()
+    assert [(e['email'], e['date']) for e in log.sink.events] == [('a@test.com', '2024-08-21')]
+
+
+class StandInLocal():
+    """ Settings for the CLI, without settings.txt or a project index. """
+    api_key, user_agent, workspace_id, times = 'alice', 'a@test.com', '1', None
+
+    def __init__(self, client):
+        self.client = client
+
+    def project_index(self):
+        return None
+
+
+def test_prefetched_days_are_served_once(client, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    cache = daycache.DayCache(str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(togglcon, 'get_day_cache', lambda: cache)
+    today = datetime.now().strftime('%Y-%m-%d')
+    client.entries_by_key['alice'].append(entry(today, 120))
+    calls = []
+    get = client.get
+    monkeypatch.setattr(client, 'get', lambda *args: calls.append(args) or get(*args))
+
+    app = togglcon.Prefetcher(StandInLocal(client))
+    app.start()
+    date = datetime.now().strftime('%d/%m/%y')
+    app.days[date].result()
+    fetched = len(calls)
+
+    timesheet, result = app.summary(date)
+    assert result['data'].to_records()[0]['Hours'] == '2.0'
+    assert len(calls) == fetched    # served from the prefetch
+    app.summary(date)
+    assert len(calls) == fetched + 1
+
+    # A prefetch older than max_age is fetched again rather than read from the day cache
+    app.start()
+    for future in app.days.values():
+        future.result()
+    fetched = len(calls)
+    app.shown.clear()
+    app.max_age = -1
+    app.summary(date)
+    assert len(calls) == fetched + 1
+
+
+def test_validate_event(client):
+    event = {'togglapikey': 'bob', 'email': 'b@test.com', 'workspace_ID': '1', 'since': '2024-08-20', 'until': '2024-08-22',
+             'validate': True, 'refresh': True}
+    response = togglcon.lambda_handler(event, {})
+
+    assert response['statusCode'] == 200
+    problems = json.loads(response['body'])['Problems']
+    assert list(problems) == ['2024-08-21']
+    assert problems['2024-08-21'][0]['errors'] == ['Missing charge type tag for entry "work". Please fix and try again.']
@@ -0,0 +1,107 @@
+""" Phase timing for the CLI and Lambda.
+
+Wrap a phase in `with timing.phase('summary_data'):`. Nothing is recorded (and the phase costs
+one check) unless timing has been started with timing.start() or a hook has been added.
+Hooks are called with (phase name, seconds) for every phase, to forward them to a collector.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger('togglcon.timing')
+logger.setLevel(logging.INFO)   # log lines show on Lambda, where the root logger is at WARNING
+
+hooks = []      # callables(name, seconds) called for every timed phase
+_active = None  # Timings being recorded, None when off
+_off = nullcontext()
+
+
+class Timings():
+    """ The phases timed between timing.start() and timing.stop(). """
+
+    def __init__(self):
+        self.records = []   # (name, seconds) in the order they finished
+        self.lock = threading.Lock()
+
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.records.append((name, seconds))
+
+
+    def totals(self):
+        """Get {phase name: (total ms, count)} in the order phases first finished."""
+        totals = {}
+        with self.lock:
+            for name, seconds in self.records:
+                ms, count = totals.get(name, (0, 0))
+                totals[name] = (ms + seconds * 1000, count + 1)
+        return totals
+
+
+    def server_timing(self):
+        """Format the totals as a Server-Timing header value."""
+        return ', '.join(f'{name};dur={ms:.1f}' + (f';desc="{count} calls"' if count > 1 else '')
+                         for name, (ms, count) in self.totals().items())
+
+
+    def log_line(self, **fields):
+        """Format the totals as one json log line, with any extra fields."""
+        return json.dumps(dict(fields, timings_ms={name: round(ms, 1) for name, (ms, count) in self.totals().items()}))
+
+
+    def log(self, **fields):
+        logger.info(self.log_line(**fields))
+
+
+class Phase():
+    """ Context manager timing one phase. """
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+
+
+def phase(name):
+    """Time a phase, if timing is on."""
+    if _active is None and not hooks:
+        return _off
+    return Phase(name)
+
+
+def record(name, seconds):
+    """Record a phase's time and pass it to the hooks, which can never break the app."""
+    active = _active
+    if active is not None:
+        active.add(name, seconds)
+    for hook in hooks:
+        try:
+            hook(name, seconds)
+        except Exception:
+            logger.exception('Timing hook failed')
+
+
+def start():
+    """Start recording phases, returning the Timings they are recorded in."""
+    global _active
+    _active = Timings()
+    return _active
+
+
+def stop():
+    """Stop recording phases, returning what was recorded (None if timing wasn't on)."""
+    global _active
+    active, _active = _active, None
+    return active
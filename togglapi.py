@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+
+API_URL = 'https://api.track.toggl.com'
+
+
+class TogglApiException(Exception):
+    """Exception raised when the Toggl api can't be reached or refuses a request."""
+    pass
+
+class TokenBucket():
+    """ Throttle allowing rate requests per second, with bursts of up to capacity requests. """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0   # set after a 429 so every caller backs off
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """Block until a request is allowed."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+
+    def pause(self, seconds):
+        """Stop handing out requests for a number of seconds."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class TogglClient():
+    """ The class to make Toggl api requests.
+
+    One client is shared by the app so connections are kept alive and pooled. Requests are
+    throttled per api key (Toggl allows roughly one per second) and retried with jittered
+    backoff on 429s, server errors and dropped connections, honouring Retry-After. Point
+    base_url at a local server to use a stand-in for Toggl.
+    """
+
+    def __init__(self, base_url=API_URL, timeout=(5, 30), rate=1.0, burst=3, retries=4, backoff=1.0, pool_size=32):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout  # (connect, read) seconds
+        self.rate = rate    # requests per second per api key
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff  # seconds, doubled each retry
+        # requests is imported here rather than at the top so starting the app stays quick
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.buckets = {}   # api key -> TokenBucket
+        self.lock = threading.Lock()
+
+
+    def bucket(self, api_key):
+        """Get the throttle shared by every request made with this api key."""
+        with self.lock:
+            if api_key not in self.buckets:
+                self.buckets[api_key] = TokenBucket(self.rate, self.burst)
+            return self.buckets[api_key]
+
+
+    def get(self, path, api_key, params=None):
+        """Get path (e.g. /api/v9/workspaces) from the api and return the decoded json."""
+        import requests
+        bucket = self.bucket(api_key)
+        for attempt in range(self.retries + 1):
+            bucket.acquire()
+            try:
+                r = self.session.get(self.base_url + path, auth=(api_key, 'api_token'), params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                if attempt == self.retries:
+                    raise TogglApiException(f"Unable to reach Toggl, please try again later. ({e})")
+                time.sleep(self.backoff_delay(attempt))
+                continue
+
+            if r.status_code == 429 or r.status_code >= 500:
+                if attempt == self.retries:
+                    raise TogglApiException(f"Toggl is busy (HTTP {r.status_code}), please try again later.")
+                # Everyone using this api key waits, not just this request
+                bucket.pause(self.retry_after(r, attempt))
+                continue
+            if r.status_code in (401, 403):
+                raise TogglApiException(f"Toggl refused the request (HTTP {r.status_code}). Please check your API key and workspace ID.")
+            if r.status_code >= 400:
+                raise TogglApiException(f"Toggl returned an error (HTTP {r.status_code}): {r.text.strip()}")
+            return r.json()
+
+
+    def backoff_delay(self, attempt):
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+
+    def retry_after(self, response, attempt):
+        """Seconds to wait before retrying, from the Retry-After header if Toggl sent one."""
+        try:
+            return float(response.headers['Retry-After']) + random.uniform(0, self.backoff / 4)
+        except (KeyError, ValueError):
+            return self.backoff_delay(attempt)
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def default_client():
+    """Get the client shared by everything in this process."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = TogglClient()
+        return _default_client
@@ -1,21 +1,103 @@
-import logic, local
+import logic, local, audit, daycache, metadata, sync, team, timing
+import argparse
+import multiprocessing
 import os
 from datetime import datetime, timedelta
 from time import sleep
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
 
-# import the AWS SDK if in AWS environment
-if 'AWS_EXECUTION_ENV' in os.environ:
-    import boto3
+# Use orjson for response bodies if it is installed, it is several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Version and welcome message
 version = '4.0.1'
 print(f'---> togglcon, version {version} <---')
 
+BATCH_WORKERS = 8   # most batch jobs run at once in one invocation
+
+profile = False    # print phase timings in the CLI, set by --profile
+
+# Days already fetched are kept between runs (and between warm Lambda invocations)
+day_cache = None
+
+# Usage log, written in the background (DynamoDB on AWS)
+audit_log = None
+
+def get_audit_log():
+    global audit_log
+    if audit_log is None:
+        audit_log = audit.from_environment() or False
+    return audit_log
+
+
+# Project indexes by (api key hash, workspace), kept between requests by the service (service.py).
+# None, as on Lambda, summarises by project name without fetching the index.
+metadata_indexes = None
+
+def get_metadata(togglapikey, workspace_ID):
+    if metadata_indexes is None:
+        return None
+    key = (metadata.user_hash(togglapikey), str(workspace_ID))
+    if key not in metadata_indexes:
+        metadata_indexes.setdefault(key, metadata.MetadataIndex(togglapikey, workspace_ID))   # one index even if two threads get here
+    return metadata_indexes[key]
+
+
+def get_day_cache():
+    global day_cache
+    if day_cache is None:
+        day_cache = daycache.DayCache()
+    return day_cache
+
+
+def dumps(body):
+    """Serialise a response body to a json string."""
+    if orjson is not None:
+        return orjson.dumps(body).decode()
+    return json.dumps(body, separators=(',', ':'), ensure_ascii=False)
+
 
 def lambda_handler(event, context):
-    
+    try:
+        return profile_event(event)
+    finally:
+        # On Lambda the usage log is written before returning, the sandbox is frozen after
+        log = get_audit_log()
+        if log and not log.background:
+            log.flush()
+
+
+def profile_event(event):
+    """ Run an event, timing its phases if asked to. """
+
+    # Time each phase if asked to, with 'profile': true in the event or TOGGLCON_PROFILE=1
+    if not (event.get('profile') or os.environ.get('TOGGLCON_PROFILE')):
+        return handle_event(event)
+    timings = timing.start()
+    try:
+        response = handle_event(event)
+    finally:
+        timing.stop()
+    timings.log(handler='lambda_handler', statusCode=response['statusCode'])
+    response.setdefault('headers', {})['Server-Timing'] = timings.server_timing()
+    return response
+
+
+def handle_event(event):
+    """ Run one Lambda event, returning the response. """
+
+    # Events with a list of jobs are run as a batch
+    if 'jobs' in event:
+        return batch_handler(event)
+    # Events with 'validate': true check a range for problems without summarising it
+    if event.get('validate'):
+        return validate_handler(event)
+
     # extract values from the event object we got from the Lambda service and store in a variable
     togglapikey = event['togglapikey']
     date_str = event['date']
@@ -27,9 +109,12 @@ def lambda_handler(event, context):
     date_str = date_obj.strftime('%d/%m/%y')
 
     # run the logic to get the timesheet data
-    timesheet = logic.TimeLogic(togglapikey, email, workspace_ID)
-    result = timesheet.summary_data(date_str) # advises if succeeded, if it does passes dataframe
-    data = json.dumps({"Data": json.loads(result['data'].to_json(orient='records'))}) # load json, put in "Data" dict, then format as json
+    cache = get_day_cache() if not event.get('refresh') else None   # 'refresh': true skips the cache
+    timesheet = logic.TimeLogic(togglapikey, email, workspace_ID, cache=cache, metadata=get_metadata(togglapikey, workspace_ID))
+    result = timesheet.summary_data(date_str) # advises if succeeded, if it does passes the timesheet table
+    log = get_audit_log()
+    if log:
+        log.record(email, date=event['date'])  # queued, written in the background
 
     # return to web app the json format to display
     if result['status'] == 'error':
@@ -38,47 +123,195 @@ def lambda_handler(event, context):
             'body': result['error']     #return error
         }
     else:
+        with timing.phase('serialise'):
+            body = dumps({"Data": result['data'].to_records()})   # rows go straight to json, in "Data" dict
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': data  
+            'body': body
         }
 
-    # Code to save details to database
 
-    # create a DynamoDB object using the AWS SDK
-    dynamodb = boto3.resource('dynamodb')
-    # use the DynamoDB object to select our table
-    table = dynamodb.Table('TogglCon.log')
-    
-    # Get the current GMT time
-    gmt_time = time.gmtime()
+def batch_handler(event):
+    """ Run many timesheet jobs from one event at the same time.
+
+    Each job has 'togglapikey', 'email', 'workspace_ID' and either 'date' or 'since'/'until'
+    (YYYY-MM-DD). The jobs share the api connection pool and each api key's rate limit.
+    Results are returned in job order, with each job's days or its error.
+    """
+    jobs = event['jobs']
+    if not isinstance(jobs, list) or not jobs:
+        return {'statusCode': 400, 'body': "'jobs' must be a list of timesheet requests"}
+    try:
+        workers = int(event.get('max_workers', BATCH_WORKERS))
+    except (TypeError, ValueError):
+        workers = 0
+    if workers < 1:
+        return {'statusCode': 400, 'body': "'max_workers' must be a whole number of at least 1"}
+    cache = get_day_cache() if not event.get('refresh') else None
+    workers = min(workers, BATCH_WORKERS, len(jobs))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(lambda job: run_job(job, cache), jobs))
+    with timing.phase('serialise'):
+        body = dumps({"Results": results})
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': body
+    }
+
+
+def validate_handler(event):
+    """ Check every entry of a date range ('date' or 'since'/'until' as YYYY-MM-DD), returning all the problems found.
+
+    The body is {"Problems": {YYYY-MM-DD: [{"description", "start", "hours", "errors"}]}} with
+    only the days that have problems.
+    """
+    try:
+        since = datetime.strptime(event.get('since', event.get('date')), '%Y-%m-%d').strftime('%d/%m/%y')
+        until = datetime.strptime(event.get('until', event.get('date')), '%Y-%m-%d').strftime('%d/%m/%y')
+    except (TypeError, ValueError) as e:
+        return {'statusCode': 400, 'body': f"Validating needs date or since/until as YYYY-MM-DD. ({e})"}
+    cache = get_day_cache() if not event.get('refresh') else None
+    timesheet = logic.TimeLogic(event['togglapikey'], event['email'], event['workspace_ID'], cache=cache,
+                                metadata=get_metadata(event['togglapikey'], event['workspace_ID']))
+    result = timesheet.validate_range(since, until)
+    log = get_audit_log()
+    if log:
+        log.record(event['email'], date=event.get('date') or f"{event['since']}/{event['until']}", validate=True)
+    if result['status'] == 'error':
+        return {'statusCode': 400, 'body': result['error']}
+    problems = {datetime.strptime(date, '%d/%m/%y').strftime('%Y-%m-%d'): day for date, day in result['problems'].items()}
+    with timing.phase('serialise'):
+        body = dumps({"Problems": problems})
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': body
+    }
+
+
+def run_job(job, cache):
+    """Summarise one batch job's date range, returning its result or error."""
+    try:
+        since = datetime.strptime(job.get('since', job.get('date')), '%Y-%m-%d').strftime('%d/%m/%y')
+        until = datetime.strptime(job.get('until', job.get('date')), '%Y-%m-%d').strftime('%d/%m/%y')
+        timesheet = logic.TimeLogic(job['togglapikey'], job['email'], job['workspace_ID'], cache=cache,
+                                    metadata=get_metadata(job['togglapikey'], job['workspace_ID']))
+    except (AttributeError, KeyError, TypeError, ValueError) as e:     # AttributeError: the job isn't an object
+        return {'status': 'error', 'error': f"Invalid job, it needs togglapikey, email, workspace_ID and date or since/until as YYYY-MM-DD. ({e})"}
+
+    result = timesheet.summary_range(since, until)
+    log = get_audit_log()
+    if log:
+        log.record(job['email'], date=job.get('date') or f"{job['since']}/{job['until']}")
+    if result['status'] == 'error':
+        return result
+    days = {}
+    for date, day in result['days'].items():
+        date = datetime.strptime(date, '%d/%m/%y').strftime('%Y-%m-%d')
+        if day['status'] == 'error':
+            days[date] = day
+        else:
+            days[date] = {'status': 'success', 'Data': day['data'].to_records()}
+    return {'status': 'success', 'days': days}
+
+
+class Prefetcher():
+    """ Warm state for the interactive CLI.
+
+    Settings, the api connection pool, the project index and the week's sync are set up once,
+    and today and yesterday are summarised on background threads as soon as the CLI starts,
+    so picking either is usually instant. A TimeLogic keeps one day's results, so each day
+    gets its own, sharing the rest.
+    """
 
-    # store the current time in a human readable format in a variable
-    # Format the GMT time string
-    now = time.strftime('%a, %d %b %Y %H:%M:%S +0000', gmt_time)
+    max_age = 120   # seconds a prefetched day is shown for before it is fetched again
 
-    # write name and time to the DynamoDB table using the object we instantiated and save response in a variable
-    response = table.put_item(
-        Item={
-            'ID-timestamp': now + "_" + email,
-            'time': now,
-            'email': email,
-            'date': date,
-            })
+    def __init__(self, local_instance=None):
+        self.local = local_instance or local.TimeLocal()  # get settings.txt loaded or setup
+        self.metadata = self.local.project_index()
+        self.week = sync.IncrementalSync(self.local.api_key, self.local.user_agent, self.local.workspace_id, self.local.client,
+                                         metadata=self.metadata)
+        self.pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='prefetch')
+        self.days = {}  # DD/MM/YY -> future of (TimeLogic, result, time finished)
+        self.shown = set()  # DD/MM/YY days already shown, fetched fresh if asked for again
 
 
-def run_local(date):
+    def start(self, week=False):
+        """Prefetch today and yesterday, and sync this week if week is set."""
+        now = datetime.now()
+        for day in (now, now - timedelta(1)):
+            date = day.strftime('%d/%m/%y')
+            self.days[date] = self.pool.submit(self.summarise, date)
+        if week:
+            self.pool.submit(self.sync_week)
+
+
+    def summarise(self, date):
+        timesheet = logic.TimeLogic(self.local.api_key, self.local.user_agent, self.local.workspace_id, self.local.client, get_day_cache(),
+                                    metadata=self.metadata)
+        result = timesheet.summary_data(date)
+        return timesheet, result, time.monotonic()
+
+
+    def refresh(self):
+        """Drop this user's cached, prefetched and synced day summaries and refetch the project
+        index, so everything is fetched again."""
+        self.days.clear()
+        self.shown.clear()
+        get_day_cache().clear(self.local.workspace_id, metadata.user_hash(self.local.api_key))
+        self.week.clear()
+        self.metadata.try_refresh()
+
+
+    def sync_week(self):
+        today = datetime.now().date()
+        try:
+            self.week.sync(today - timedelta(days=today.weekday()))
+        except logic.TogglApiException:
+            pass    # run_week syncs again and shows the error
+
+
+    def summary(self, date):
+        """Get (TimeLogic, result) for a day, from the prefetch if it is recent enough.
+
+        A day asked for again, or prefetched too long ago, skips the prefetch and the day
+        cache, so it shows any changes."""
+        future = self.days.pop(date, None)
+        if future is not None and date not in self.shown:
+            timesheet, result, finished = future.result()
+            if time.monotonic() - finished <= self.max_age:
+                self.shown.add(date)
+                return timesheet, result
+        if future is not None or date in self.shown:
+            try:
+                get_day_cache().forget(self.local.workspace_id, metadata.user_hash(self.local.api_key),
+                                       datetime.strptime(date, '%d/%m/%y').date())
+            except ValueError:
+                pass    # not a date, summarise shows the error
+        self.shown.add(date)
+        timesheet, result, finished = self.summarise(date)
+        return timesheet, result
+
+
+def run_local(date, app=None):
     """ If running locally, load local package and gather settings to use for api calls. """
 
-    local_instance = local.TimeLocal()  # get settings.txt loaded or setup
+    app = app or Prefetcher()
+    local_instance = app.local
 
     # get timesheet data for date
-    timesheet = logic.TimeLogic(local_instance.api_key, local_instance.user_agent, local_instance.workspace_id) 
     print('Loading...', end = '') # let user know loading
-    result = timesheet.summary_data(date) # timesheet run
+    timesheet, result = app.summary(date) # timesheet run
     local_instance.times = timesheet.times # pass variable to local_instance
     
     if result['status'] == 'error': # show error if one
@@ -91,21 +324,164 @@ def run_local(date):
         local_instance.excelLoad()   # copy to excel
 
 
-def main():
+def run_week(app=None):
+    """ Show this week's timesheets so far, only recomputing days changed since the last run. """
+
+    app = app or Prefetcher()
+    local_instance = app.local
+    today = datetime.now().date()
+    monday = today - timedelta(days=today.weekday())
+    print('Loading...', end = '') # let user know loading
+    result = app.week.summary_range(monday.strftime('%d/%m/%y'), today.strftime('%d/%m/%y'))
+    if result['status'] == 'error': # show error if one
+        print(result['error'])
+        return
+
+    rows = []
+    for date, day in result['days'].items():
+        if day['status'] == 'error':
+            print(f'\n{date}: {day["error"]}')
+        elif len(day['data']) == 0:
+            print(f'\n{date}: No timesheet entries.')
+        else:
+            print(f'\n{date}: {day["total_hours"]} hrs total.')
+            local_instance.times = day['data']
+            local_instance.display_data()    # print timesheet to terminal
+            rows.extend(day['data'])
+    if rows:
+        local_instance.times = logic.TimeTable(rows)
+        local_instance.excelLoad()   # copy the whole week to excel
+
+
+def run_export(since, until, path, app=None):
+    """ Write every day from since to until (DD/MM/YY) to an .xlsx workbook, one sheet per week. """
+
+    app = app or Prefetcher()
+    timesheet = logic.TimeLogic(app.local.api_key, app.local.user_agent, app.local.workspace_id, app.local.client, get_day_cache(),
+                                metadata=app.metadata)
+    print('Loading...', end = '') # let user know loading
+
+    def days():
+        # Days are summarised as they stream in and written straight to the workbook
+        for date, result in timesheet.summary_stream(since, until):
+            if result['status'] == 'error':
+                print(f'\n{date}: {result["error"]}')
+            else:
+                yield date, result['data']
+
+    try:
+        local.export_workbook(path, local.week_sheets(days()))
+    except (logic.TIMESHEET_EXCEPTIONS + (OSError,)) as e:
+        print(f'\nERROR: Unable to export. {e}')
+        return
+    print(f'\nTimesheets saved to {path}.')
+
+
+def run_team(since, until, path, config='team.json'):
+    """ Write every team member's timesheets from since to until (DD/MM/YY) to an .xlsx workbook, one sheet per member. """
+
+    try:
+        members = local.load_team(config)
+    except (OSError, ValueError, KeyError) as e:
+        print(f'ERROR: Unable to read {config}. {e}')
+        return
+    print(f'Loading {len(members)} timesheets...', end = '') # let user know loading
+    results = team.run_team(members, since, until, cache=get_day_cache())
+
+    sheets = []
+    for user_agent, result in results.items():
+        if result['status'] == 'error':
+            print(f'\n{user_agent}: {result["error"]}')
+            continue
+        for date, error in result['errors'].items():
+            print(f'\n{user_agent} {date}: {error}')
+        sheets.append((user_agent, result['rows']))
+    try:
+        local.export_workbook(path, sheets)
+    except OSError as e:
+        print(f'\nERROR: Unable to export. {e}')
+        return
+    print(f'\nTeam timesheets saved to {path}.')
+
+
+def run_validate(since, until, app=None):
+    """ List every problem with the entries from since to until (DD/MM/YY), fetching the range once. """
+
+    app = app or Prefetcher()
+    timesheet = logic.TimeLogic(app.local.api_key, app.local.user_agent, app.local.workspace_id, app.local.client, get_day_cache(),
+                                metadata=app.metadata)
+    print('Checking...', end = '') # let user know loading
+    result = timesheet.validate_range(since, until)
+    if result['status'] == 'error': # show error if one
+        print(result['error'])
+        return
+    if not result['problems']:
+        print('No problems found.')
+        return
+    count = sum(len(day) for day in result['problems'].values())
+    print(f'{count} entries need fixing.')
+    for date, problems in result['problems'].items():
+        print(f'\n{date}:')
+        for problem in problems:
+            print(f'    {problem["start"][11:16]} "{problem["description"]}" ({problem["hours"]}hr)')
+            for error in problem['errors']:
+                print(f'        {error}')
+
+
+def profiled(fn, *args):
+    """Run a CLI command, printing how long each phase took if --profile was given."""
+    if not profile:
+        return fn(*args)
+    timings = timing.start()
+    try:
+        return fn(*args)
+    finally:
+        timing.stop()
+        print('\nProfile:', timings.log_line(command=fn.__name__))
+
+
+def main(prefetch_week=False):
     # Terminal line interation with local user to control program
+    app = Prefetcher()
+    app.start(week=prefetch_week)   # today and yesterday load while the user chooses
     choice = ''
     while True:   
-        choice = input('\nView today (enter), yesterday (y), specific (DD/MM/YY), help (h) or exit (e): ')    
+        choice = input('\nView today (enter), yesterday (y), this week (w), export to Excel (x), team export (t), check for problems (v), refresh (r), specific (DD/MM/YY), help (h) or exit (e): ')    
         if choice == '':
             # Get today's timesheet and open it in Excel
             date = datetime.strftime(datetime.now(), '%d/%m/%y')
-            if run_local(date) is not None:  #Run the program, if no errors allow the program to close.
+            if profiled(run_local, date, app) is not None:  #Run the program, if no errors allow the program to close.
                 input('\nPress any key to exit...')
                 exit()
         elif choice == 'y':
             # Get yesterday's timesheet
             date = datetime.strftime(datetime.now() - timedelta(1), '%d/%m/%y')
-            timesheet_data = run_local(date)
+            timesheet_data = profiled(run_local, date, app)
+        elif choice == 'w':
+            # Get this week's timesheets, syncing only what changed
+            profiled(run_week, app)
+        elif choice == 'x':
+            # Export a range of days to a workbook
+            since = input('From (DD/MM/YY): ')
+            until = input('To (DD/MM/YY): ')
+            path = input('Save as (enter for timesheets.xlsx): ') or 'timesheets.xlsx'
+            profiled(run_export, since, until, path, app)
+        elif choice == 't':
+            # Export the whole team's timesheets from team.json to a workbook
+            since = input('From (DD/MM/YY): ')
+            until = input('To (DD/MM/YY): ')
+            path = input('Save as (enter for team.xlsx): ') or 'team.xlsx'
+            profiled(run_team, since, until, path)
+        elif choice == 'r':
+            # Fetch everything again, e.g. after fixing old entries in Toggl
+            app.refresh()
+            print('Cached days cleared, they will be fetched again.')
+        elif choice == 'v':
+            # Check a range for every problem at once, this week if no dates are given
+            today = datetime.now()
+            since = input('From (DD/MM/YY, enter for this week): ') or (today - timedelta(days=today.weekday())).strftime('%d/%m/%y')
+            until = input('To (DD/MM/YY, enter for today): ') or today.strftime('%d/%m/%y')
+            profiled(run_validate, since, until, app)
         elif choice =='h':
             # See help
             print('App version:', version)
@@ -116,8 +492,22 @@ def main():
         else:
             # Assume user has entered date in format DD/MM/YY
             date = choice
-            timesheet_data = run_local(date)
+            timesheet_data = profiled(run_local, date, app)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Get Toggl timesheets ready to paste into Excel.')
+    parser.add_argument('--profile', action='store_true', help='print how long each phase takes')
+    parser.add_argument('--prefetch-week', action='store_true', help='also sync this week in the background at startup')
+    parser.add_argument('--team', nargs=2, metavar=('FROM', 'TO'), help='export the team in team.json from FROM to TO (DD/MM/YY) and exit')
+    parser.add_argument('--out', default='team.xlsx', help='workbook the team export is saved to')
+    parser.add_argument('--refresh', action='store_true', help="don't use cached days, fetch everything again")
+    args = parser.parse_args()
+    profile = args.profile
+    if args.refresh:
+        get_day_cache().bypass = True
+    multiprocessing.freeze_support()    # the team export's process pool, when built with pyinstaller
+    if args.team:
+        profiled(run_team, args.team[0], args.team[1], args.out)
+    else:
+        main(args.prefetch_week)
\ No newline at end of file